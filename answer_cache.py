@@ -0,0 +1,101 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# LRU cache of AI answers keyed by (model, question type, normalized short question). Questions repeat a lot, usable
+# address questions only depend on the prefix so there are 33 of them, and a cached answer skips the model entirely
+
+MAX_ENTRIES = 4096
+TTL_SECONDS = 24 * 60 * 60
+
+
+def normalize_question(question_type, short_question):
+    # Questions with the same answer share a key
+    short_question = " ".join(short_question.split())
+    if question_type == "Usable IP Addresses of a Subnet":
+        return short_question.rpartition("/")[2]  # only the prefix length matters
+    return short_question
+
+
+class AnswerCache:
+
+    def __init__(self, max_entries=MAX_ENTRIES, ttl_seconds=TTL_SECONDS, path=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self.entries = OrderedDict()  # key -> (answer, time stored), least recently used first
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, model, question_type, short_question):
+        return model, question_type, normalize_question(question_type, short_question)
+
+    def get(self, model, question_type, short_question):
+        key = self.key(model, question_type, short_question)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.expired(entry):
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, model, question_type, short_question, answer, stored=None):
+        key = self.key(model, question_type, short_question)
+        with self.lock:
+            self.entries[key] = (answer, time.time() if stored is None else stored)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def expired(self, entry):
+        return self.ttl_seconds is not None and time.time() - entry[1] > self.ttl_seconds
+
+    def preseed(self, model, question_type, short_questions, solve):
+        # Fills in answers worked out locally, for question types with a deterministic solver
+        for short_question in short_questions:
+            answer = solve(question_type, short_question)
+            if answer:
+                self.put(model, question_type, short_question, answer)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses,
+                    "hit_rate": self.hits / lookups if lookups else 0.0}
+
+    def load(self):
+        # Entries saved by an earlier run, expired ones are skipped, a missing or damaged file starts empty
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                saved = json.load(file)
+        except (OSError, ValueError):
+            return
+        for model, question_type, short_question, answer, stored in saved:
+            if not self.expired((answer, stored)):
+                self.put(model, question_type, short_question, answer, stored)
+
+    def save(self):
+        # Written to a temporary file first, so a run stopped mid write never leaves a damaged cache
+        if self.path is None:
+            return
+        with self.lock:
+            saved = [[*key, answer, stored] for key, (answer, stored) in self.entries.items()]
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            json.dump(saved, file)
+        os.replace(temporary_path, self.path)
+
+
+def usable_address_questions():
+    # One question per prefix length covers every usable address question
+    return [f"0.0.0.0/{prefix}" for prefix in range(33)]
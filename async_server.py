@@ -0,0 +1,312 @@
+import asyncio
+import json
+import sys
+import time
+import event_log
+import framing
+import metrics
+import rooms
+import server
+import workers
+
+# Player dicts match server.py, but hold a stream reader and writer instead of a socket
+
+
+def main(config):
+    try:
+        asyncio.run(serve(config))
+    except KeyboardInterrupt:
+        pass
+
+
+async def serve(config):
+    port = config["port"]
+    lobby = rooms.Lobby(config["players"])
+    game_tasks = set()  # strong references so running games aren't garbage collected
+
+    def on_connection(reader, writer):
+        metrics.ACCEPTS.inc()
+        return handle_connection(reader, writer, lobby, config, game_tasks)
+
+    try:
+        # reuse_address allows immediate server reuse just like the threaded engine, limit caps one line like LineBuffer
+        listener = await asyncio.start_server(on_connection, "0.0.0.0", port, reuse_address=True,
+                                              limit=framing.MAX_FRAME_SIZE)
+    except OSError:
+        sys.stderr.write(f"server.py: Binding to port {port} was unsuccessful\n")
+        sys.exit(1)
+
+    async with listener:
+        await listener.serve_forever()  # keeps accepting while games run
+
+
+async def serve_handoffs(channel, config):
+    # Worker process version of serve, connections arrive from the dispatcher instead of a listening socket
+    loop = asyncio.get_running_loop()
+    lobby = workers.WorkerLobby(config["players"], channel)
+    game_tasks = set()
+    connection_tasks = set()
+
+    while True:
+        handoff = await loop.run_in_executor(None, workers.receive_handoff, channel)
+        if handoff is None:  # dispatcher has gone away
+            break
+
+        connection, received = handoff
+        reader = asyncio.StreamReader(limit=framing.MAX_FRAME_SIZE)
+        reader.feed_data(received)  # bytes the dispatcher already read come before anything else on the socket
+        transport, protocol = await loop.connect_accepted_socket(lambda: asyncio.StreamReaderProtocol(reader),
+                                                                 sock=connection)
+        writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+
+        task = asyncio.create_task(handle_connection(reader, writer, lobby, config, game_tasks))
+        connection_tasks.add(task)
+        task.add_done_callback(connection_tasks.discard)
+
+
+async def handle_connection(reader, writer, lobby, config, game_tasks):
+    player, room = await handle_add_client(reader, writer, lobby, config, game_tasks)
+    if player is None:
+        writer.close()
+        return
+
+    await receive_loop(player, room, lobby)
+
+
+async def handle_add_client(reader, writer, lobby, config, game_tasks):
+    # Waits for the HI message on a new connection, one coroutine per connection instead of a thread
+    while True:
+        try:
+            line = await reader.readline()
+        except ValueError:  # longer than the frame limit
+            metrics.DROPPED_TOO_LARGE.inc()
+            return None, None
+        except ConnectionError:
+            return None, None
+        if not line:
+            return None, None
+
+        message = decode_line(line)
+        if message is None:
+            continue
+
+        if message.get("message_type") == "HI":
+            player = {"reader": reader, "writer": writer, "username": message.get("username"), "score": 0,
+                      "connected": True, "leaderboard_delta": server.read_leaderboard_delta(message),
+                      "protocol": server.read_protocol(message)}
+            room, full = lobby.join(player, server.read_room_id(message))
+            metrics.JOINS.inc()
+            server.record_join(room, player)
+            if full:
+                task = asyncio.create_task(run_room(room, config))
+                game_tasks.add(task)
+                task.add_done_callback(game_tasks.discard)
+            return player, room
+
+
+async def run_room(room, config):
+    room.game = {"answers": {}, "pending": set(), "all_answered": asyncio.Event()}
+    print(f"All players connected in room {room.room_id}. Ready to start the game!")
+    metrics.GAMES_STARTED.inc()
+    metrics.ROOMS_ACTIVE.inc()
+    server.create_question_pool(room, config)
+    server.record_game_start(room, config)
+    try:
+        await main_game_handler(room, config)
+    finally:
+        room.question_pool.close()
+        metrics.ROOMS_ACTIVE.dec()
+
+
+async def receive_loop(player, room, lobby):
+    # Reads every message from a joined player for as long as they stay connected
+    while True:
+        try:
+            line = await player["reader"].readline()
+        except ValueError:
+            metrics.DROPPED_TOO_LARGE.inc()
+            line = b""
+        except ConnectionError:
+            line = b""
+        received_ns = time.monotonic_ns()  # timestamp on arrival, before any parsing
+
+        if not line:
+            break
+
+        message = decode_line(line)
+        if message is None:
+            continue
+
+        username = player["username"]
+        if message.get("message_type") == "ANSWER":
+            if "answer" not in message:
+                metrics.DROPPED_MALFORMED.inc()
+                continue
+            if username not in room.game.get("pending", ()):  # between questions or already answered
+                metrics.DROPPED_LATE.inc()
+                continue
+            room.game["answers"][username] = message["answer"]
+            player["answer_received_ns"] = received_ns
+            answered(room, username)
+        elif message.get("message_type") == "LEADERBOARD_REQUEST":
+            player["leaderboard_snapshot"] = True
+        elif message.get("message_type") != "BYE":
+            metrics.DROPPED_UNEXPECTED.inc()
+
+    player["connected"] = False
+    if not room.started:  # disconnected while waiting in the lobby, free up their spot
+        lobby.leave(player, room)
+        metrics.LOBBY_LEAVES.inc()
+        event_log.record("leave", room=room.room_id, player=player["leaderboard_key"][1])
+    elif room.game:
+        answered(room, player["username"])  # stop waiting on a player who left mid question
+
+
+def decode_line(line):
+    # Same rule as framing.LineBuffer, a line that isn't a JSON object is counted and skipped
+    try:
+        message = json.loads(line.decode().strip())
+    except ValueError:
+        message = None
+    if not isinstance(message, dict):
+        metrics.DROPPED_MALFORMED.inc()
+        return None
+    return message
+
+
+def answered(room, username):
+    room.game["pending"].discard(username)
+    if not room.game["pending"]:
+        room.game["all_answered"].set()
+
+
+async def send_json_all_players(room, message):
+    encoded = {}  # serialised once per protocol, the same bytes go to every player using it
+    targets = [player for player in room.players if player["connected"]]
+    start_ns = time.monotonic_ns()
+    await asyncio.gather(*(send_payload(player, framing.encode_for(player["protocol"], message, encoded))
+                           for player in targets))
+    metrics.BROADCAST_SECONDS.observe((time.monotonic_ns() - start_ns) / 1e9)
+    return server.delivery_stats(targets, start_ns)
+
+
+async def send_payload(player, payload):
+    # The transport buffer is the players outbox, it is capped and drained with a deadline like the threaded engine
+    if not player["connected"]:
+        return
+    writer = player["writer"]
+    if writer.transport.get_write_buffer_size() > server.MAX_OUTBOX_BYTES:  # behind already, not this message's size
+        evict_player(player, metrics.SEND_SLOW_CONSUMER)
+        return
+
+    try:
+        writer.write(payload)
+        if not writer.transport.get_write_buffer_size():  # written straight to the kernel, usually the case
+            player["delivered_ns"] = time.monotonic_ns()
+            return
+        await asyncio.wait_for(writer.drain(), timeout=server.SLOW_CONSUMER_SECONDS)
+    except asyncio.TimeoutError:
+        evict_player(player, metrics.SEND_SLOW_CONSUMER)
+        return
+    except (ConnectionError, OSError):
+        evict_player(player, metrics.SEND_ERROR)
+        return
+    player["delivered_ns"] = time.monotonic_ns()
+
+
+def evict_player(player, failure):
+    if player["connected"]:
+        failure.inc()
+    player["connected"] = False
+    player["writer"].close()
+
+
+async def main_game_handler(room, config):
+    phases = server.load_phase_seconds(config)
+    await send_json_all_players(room, server.build_ready_message(config))
+
+    await asyncio.sleep(config["question_interval_seconds"])
+
+    question_types = config["question_types"]
+    time_limit = config["question_seconds"]
+
+    for i, question_type in enumerate(question_types):
+        question = room.question_pool.next_question(question_type)
+        open_round(room)  # before sending, a fast player can answer while others are still being sent the question
+        question_message = server.build_question_message(config, i, question)
+        question_start = time.monotonic()
+        broadcast_ns = time.monotonic_ns()
+        server.report_delivery(room, i, await send_json_all_players(room, question_message))
+        server.mark_question_sent(room, broadcast_ns)
+        server.record_question(room, i, question)
+
+        player_responses = await collect_player_responses(room, time_limit)
+        metrics.PHASE_QUESTION.observe(time.monotonic() - question_start)
+
+        phase_start = await wait_for_phase(time.monotonic(), phases["result"])  # same phases as the threaded engine
+        await send_results(room, player_responses, question, config)
+        metrics.PHASE_RESULTS.observe(time.monotonic() - phase_start)
+
+        if i < len(question_types) - 1:  # Don't send leaderboard on final question
+            phase_start = await wait_for_phase(phase_start, phases["leaderboard"])
+            await send_leaderboard(room, config, i)
+            metrics.PHASE_LEADERBOARD.observe(time.monotonic() - phase_start)
+            await wait_for_phase(phase_start, phases["question"])
+        else:
+            await wait_for_phase(phase_start, phases["finished"])
+
+    await send_finished(room, config)
+
+
+async def wait_for_phase(previous_start, seconds):
+    await asyncio.sleep(server.phase_delay(previous_start, seconds))
+    return time.monotonic()
+
+
+def open_round(room):
+    room.game["answers"] = {}
+    room.game["pending"] = {player["username"] for player in room.players if player["connected"]}
+    room.game["all_answered"].clear()
+
+
+async def collect_player_responses(room, time_limit):
+    # Answers arrive through each players receive_loop, so this only waits until everyone answered or time is up
+    game = room.game
+    game["pending"] &= {player["username"] for player in room.players if player["connected"]}  # drop evicted players
+    if game["pending"]:
+        try:
+            await asyncio.wait_for(game["all_answered"].wait(), timeout=time_limit + 0.5)
+        except asyncio.TimeoutError:
+            pass
+
+    game["pending"] = set()
+    return game["answers"]
+
+
+async def send_results(room, player_responses, question, config):
+    sends = []
+    for player in room.players:
+        player_response = player_responses.get(player["username"])
+        if player_response is None:  # player didn't answer so don't send a message
+            continue
+
+        result_message = server.build_result_message(room, player, player_response, question, config)
+        sends.append(send_payload(player, framing.ENCODERS[player["protocol"]](result_message)))
+
+    await asyncio.gather(*sends)
+
+
+async def send_leaderboard(room, config, index):
+    targets = [player for player in room.players if player["connected"]]
+    payloads = server.build_leaderboard_payloads(room, targets, config, index)
+    await asyncio.gather(*(send_payload(player, payload) for player, payload in payloads))
+
+
+async def send_finished(room, config):
+    await send_json_all_players(room, server.build_finished_message(room, config))
+    server.record_finished(room)
+
+    for player in room.players:
+        player["writer"].close()
+
+    room.players.clear()
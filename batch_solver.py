@@ -0,0 +1,117 @@
+# Batch versions of the subnet and Roman numeral solvers for offline question banks and benchmarks.
+# Results match the scalar functions in solvers.py exactly, including "" for anything they can't solve.
+import re
+import numpy as np
+import questions
+
+PLAIN_SUBNET = re.compile(r"\d{1,9}\.\d{1,9}\.\d{1,9}\.\d{1,9}/\d{1,9}", re.ASCII)
+
+MASKS = np.array([(0xFFFFFFFF << (32 - prefix)) & 0xFFFFFFFF for prefix in range(33)], dtype=np.uint64)
+USABLE = np.array([str(2 ** (32 - prefix) - 2 if prefix < 31 else 2 ** (32 - prefix)) for prefix in range(33)],
+                  dtype=object)
+OCTET_PAIRS = np.array([f"{high}.{low}" for high in range(256) for low in range(256)], dtype=object)  # 16 bit halves
+
+ROMAN_VALUES = np.zeros(256, dtype=np.int64)  # byte -> numeral value, anything else counts as 0 like the scalar solver
+for numeral, value in {"I": 1, "V": 5, "X": 10, "L": 50, "C": 100, "D": 500, "M": 1000}.items():
+    ROMAN_VALUES[ord(numeral)] = value
+
+
+def batch_solve(question_type, short_questions):
+    solver = BATCH_SOLVERS.get(question_type)
+    if solver is None:  # no batch version, fall back to the registered scalar solver
+        return [questions.solve_answer(question_type, short_question) for short_question in short_questions]
+    return solver(short_questions)
+
+
+def parse_subnets(short_questions):
+    # Returns prefixes, addresses and masks of which questions have a usable prefix and a usable address.
+    # Plain "a.b.c.d/p" questions are converted in one numpy call, anything unusual goes through the scalar rules.
+    count = len(short_questions)
+    plain = np.array([isinstance(short_question, str) and PLAIN_SUBNET.fullmatch(short_question) is not None
+                      for short_question in short_questions], dtype=bool)
+
+    fields = np.zeros((count, 5), dtype=np.uint64)
+    if plain.any():
+        joined = ".".join(short_question for short_question, is_plain in zip(short_questions, plain.tolist()) if is_plain)
+        fields[plain] = np.fromstring(joined.replace("/", "."), dtype=np.uint64, sep=".").reshape(-1, 5)
+
+    prefix_valid = plain.copy()
+    address_valid = plain.copy()
+    for i in np.flatnonzero(~plain):
+        prefix, octets = parse_subnet(short_questions[i])
+        if prefix is not None:
+            fields[i, 4] = prefix
+            prefix_valid[i] = True
+        if octets is not None:
+            fields[i, :4] = octets
+            address_valid[i] = True
+
+    prefixes = fields[:, 4].astype(np.int64)
+    prefix_valid &= prefixes <= 32  # parse_subnet maps any out of range prefix to 33
+    prefixes[~prefix_valid] = 0
+
+    octets = fields[:, :4] & np.uint64(0xFFFFFFFF)
+    addresses = ((octets[:, 0] << np.uint64(24)) | (octets[:, 1] << np.uint64(16)) | (octets[:, 2] << np.uint64(8)) |
+                 octets[:, 3]) & np.uint64(0xFFFFFFFF)
+    return prefixes, addresses, prefix_valid, address_valid & prefix_valid
+
+
+def parse_subnet(short_question):
+    # Scalar rules for anything that isn't a plain question, extra octets are ignored and each is taken modulo 2 ** 32
+    try:
+        ip_str, prefix = short_question.split("/")
+        prefix = int(prefix)
+    except (AttributeError, ValueError):
+        return None, None
+    prefix = prefix if 0 <= prefix <= 32 else 33
+
+    try:
+        parts = [int(part) & 0xFFFFFFFF for part in ip_str.split(".")]
+        return prefix, parts[:4] if len(parts) >= 4 else None
+    except ValueError:
+        return prefix, None
+
+
+def batch_usable_addresses(short_questions):
+    prefixes, _, prefix_valid, _ = parse_subnets(short_questions)
+    return np.where(prefix_valid, USABLE[prefixes], "").tolist()  # usable count only depends on the prefix
+
+
+def batch_network_broadcast(short_questions):
+    prefixes, addresses, _, valid = parse_subnets(short_questions)
+
+    masks = MASKS[prefixes]
+    networks = addresses & masks
+    broadcasts = (addresses | (~masks & np.uint64(0xFFFFFFFF))) & np.uint64(0xFFFFFFFF)
+
+    # Each address is two lookups of its 16 bit halves, joined by numpy over the whole batch
+    low_bits = np.uint64(0xFFFF)
+    results = (OCTET_PAIRS[networks >> np.uint64(16)] + "." + OCTET_PAIRS[networks & low_bits] + " and " +
+               OCTET_PAIRS[broadcasts >> np.uint64(16)] + "." + OCTET_PAIRS[broadcasts & low_bits])
+    return np.where(valid, results, "").tolist()
+
+
+def batch_roman_numerals(numerals):
+    valid = np.array([isinstance(numeral, str) for numeral in numerals], dtype=bool)
+    encoded = [numeral.encode() if is_valid else b"" for numeral, is_valid in zip(numerals, valid.tolist())]
+    width = max((len(numeral) for numeral in encoded), default=0)
+    if width == 0:
+        return ["0" if is_valid else "" for is_valid in valid.tolist()]
+
+    # One row of byte values per numeral, zero padding on the right adds nothing to the total
+    matrix = np.array(encoded, dtype=f"S{width}").view(np.uint8).reshape(len(encoded), width)
+    values = ROMAN_VALUES[matrix][:, ::-1]  # read right to left like the scalar solver
+
+    # A numeral is subtracted when it is smaller than the largest numeral to its right
+    largest_to_right = np.maximum.accumulate(values, axis=1)
+    largest_to_right = np.concatenate([np.zeros((len(encoded), 1), dtype=np.int64), largest_to_right[:, :-1]], axis=1)
+    totals = np.where(values < largest_to_right, -values, values).sum(axis=1)
+
+    return [str(total) if is_valid else "" for total, is_valid in zip(totals.tolist(), valid.tolist())]
+
+
+BATCH_SOLVERS = {
+    "Roman Numerals": batch_roman_numerals,
+    "Usable IP Addresses of a Subnet": batch_usable_addresses,
+    "Network and Broadcast Address of a Subnet": batch_network_broadcast
+}
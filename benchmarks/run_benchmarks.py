@@ -0,0 +1,277 @@
+import asyncio
+import hashlib
+import itertools
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Paths to files
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_PY = os.path.join(ROOT, 'server.py')
+BASELINE_JSON = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+OUTPUT = os.path.join(ROOT, 'bench_output.txt')
+
+sys.path.insert(0, ROOT)
+import framing
+import loadgen
+import questions
+import rooms
+import server
+
+# Usage: python benchmarks/run_benchmarks.py [--quick] [--update-baseline] [--output <file>]
+# Every result is nanoseconds per operation (lower is better), written as json. Each timed run is also divided by a
+# fixed calibration loop timed right before it, so a machine running slower or faster for a while moves both alike,
+# and the median of those ratios is what gets compared. A relative result slower than the stored baseline by more
+# than its tolerance fails the run, but only against a baseline made on this machine, one from elsewhere is reported
+# without failing. --update-baseline stores this run as the new baseline instead.
+
+CONFIG = {
+    "port": 8898,
+    "players": 2,
+    "question_types": list(questions.QUESTION_TYPES),
+    "question_formats": {question_type: "{}" for question_type in questions.QUESTION_TYPES},
+    "question_seconds": 2,
+    "question_interval_seconds": 0,
+    "ready_info": "Game starts in {question_interval_seconds} seconds!",
+    "question_word": "Question",
+    "correct_answer": "{answer} is correct!",
+    "incorrect_answer": "The correct answer is {correct_answer}, but your answer {answer} is incorrect :(",
+    "points_noun_singular": "point",
+    "points_noun_plural": "points",
+    "final_standings_heading": "Final standings:",
+    "one_winner": "The winner is: {}",
+    "multiple_winners": "The winners are: {}"
+}
+
+
+def main():
+    quick = "--quick" in sys.argv  # skips the 100k player room and the end to end game
+    output = sys.argv[sys.argv.index("--output") + 1] if "--output" in sys.argv else OUTPUT
+
+    results = {}
+    relative = {}
+    for name, benchmark in benchmarks(quick):
+        results[name], relative[name] = benchmark()
+        print(f"{name}: {format_ns(results[name])} ({relative[name]:.4f} calibration loops)")
+
+    run = {"machine": machine_id(), "results": results, "relative": relative}
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(run, file, indent=2)
+
+    if "--update-baseline" in sys.argv:
+        save_baseline(run)
+        print(f"Baseline saved to {BASELINE_JSON}")
+        return
+
+    baseline = load_baseline()
+    regressions = compare(relative, baseline)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    print("\n--- BENCHMARK SUMMARY ---")
+    if baseline.get("machine") != run["machine"]:
+        print("Baseline was made on another machine, regressions are not failing the run. "
+              "Run with --update-baseline first to gate on this machine.")
+        return
+    print("Regressions found." if regressions else "No regressions.")
+    sys.exit(1 if regressions else 0)
+
+
+CALIBRATION_CALLS = 20  # calibration loops timed before each run, a few milliseconds
+
+
+def calibration_loop():
+    # Fixed mix of the interpreter work the benchmarks do, dict and string building and integer arithmetic
+    table = {}
+    for i in range(200):
+        table[f"player-{i}"] = i * i % 97
+    return sum(len(key) + value for key, value in table.items())
+
+
+def machine_id():
+    # Tells apart baselines from different machines or Python versions without storing the host name
+    details = f"{platform.node()} {platform.machine()} {platform.python_implementation()} {platform.python_version()}"
+    return hashlib.sha256(details.encode()).hexdigest()[:16]
+
+
+def benchmarks(quick):
+    for question_type in questions.QUESTION_TYPES:
+        yield f"generate/{question_type}", lambda t=question_type: bench_generate(t)
+        yield f"evaluate_answer/{question_type}", lambda t=question_type: bench_evaluate(t)
+
+    for protocol in framing.ENCODERS:
+        yield f"encode/{protocol}/QUESTION", lambda p=protocol: bench_encode_question(p)
+        yield f"encode/{protocol}/RESULT", lambda p=protocol: bench_encode_result(p)
+
+    for player_count in (10, 1000) if quick else (10, 1000, 100000):
+        yield f"leaderboard/full/{player_count}", lambda n=player_count: bench_leaderboard(n, delta=False)
+        yield f"leaderboard/delta/{player_count}", lambda n=player_count: bench_leaderboard(n, delta=True)
+        yield f"finished/{player_count}", lambda n=player_count: bench_finished(n)
+
+    if not quick:
+        yield "game/200 players", lambda: bench_game(200)
+
+
+def measure(function, number=None, repeat=15, min_seconds=0.01):
+    # Best of several runs per call, and the median of each run's time relative to the calibration loop timed just
+    # before it. Without number, each run calls function for at least min_seconds
+    if number is None:
+        number = 1
+        while time_calls(function, number) < min_seconds * 1e9:
+            number *= 2
+
+    runs = []
+    for _ in range(repeat):
+        calibration = time_calls(calibration_loop, CALIBRATION_CALLS) / CALIBRATION_CALLS
+        elapsed = time_calls(function, number) / number
+        runs.append((elapsed, elapsed / calibration))
+    return round(min(elapsed for elapsed, _ in runs)), round(statistics.median(ratio for _, ratio in runs), 4)
+
+
+def time_calls(function, number):
+    start = time.perf_counter_ns()
+    for _ in range(number):
+        function()
+    return time.perf_counter_ns() - start
+
+
+def bench_generate(question_type):
+    generator = questions.QUESTION_TYPES[question_type].generator
+    rng = random.Random(1112)
+    return measure(lambda: generator(rng))
+
+
+def bench_evaluate(question_type):
+    rng = random.Random(1112)
+    short_questions = [questions.QUESTION_TYPES[question_type].generator(rng) for _ in range(2000)]
+    short_question_iter = itertools.cycle(short_questions)
+    return measure(lambda: server.evaluate_answer(question_type, next(short_question_iter), None))
+
+
+def bench_encode_question(protocol):
+    message = server.build_question_message(CONFIG, 0, questions.Question("Mathematics", "12 + 7 - 3"))
+    encode = framing.ENCODERS[protocol]
+    return measure(lambda: encode(message))
+
+
+def bench_encode_result(protocol):
+    message = {"message_type": "RESULT", "correct": False, "points": 0, "latency_ms": 812.4,
+               "feedback": CONFIG["incorrect_answer"].format(answer="15", correct_answer="16")}
+    encode = framing.ENCODERS[protocol]
+    return measure(lambda: encode(message))
+
+
+def build_room(player_count, delta):
+    rng = random.Random(1112)
+    room = rooms.Room("bench", player_count)
+    for i in range(player_count):
+        player = {"username": f"player-{i}", "score": rng.randint(0, 10), "connected": True,
+                  "leaderboard_delta": delta, "leaderboard_round": 0, "protocol": "json"}
+        room.players.append(player)
+        room.leaderboard.add(player)
+    return room, rng
+
+
+def bench_leaderboard(player_count, delta):
+    # One round, a tenth of the room scores and every player's LEADERBOARD bytes are built
+    room, rng = build_room(player_count, delta)
+    scorers = [rng.sample(room.players, max(1, player_count // 10)) for _ in range(7)]
+    rounds = itertools.cycle(scorers)  # small rooms are timed over many rounds, one is too short to time reliably
+
+    def one_round():
+        for player in next(rounds):
+            player["score"] += 1
+            room.leaderboard.update(player)
+        server.build_leaderboard_payloads(room, room.players, CONFIG, 1)  # not a full snapshot round
+
+    return measure(one_round)
+
+
+def bench_finished(player_count):
+    room, _ = build_room(player_count, False)
+    number = 1 if player_count > 1000 else None  # a single 100k player message already takes long enough
+    return measure(lambda: framing.encode_message(server.build_finished_message(room, CONFIG)), number)
+
+
+def bench_game(player_count):
+    # Whole local game against a real threaded server, from the first connect until every player has FINISHED
+    config = dict(CONFIG, players=player_count)
+    with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.json') as config_file:
+        json.dump(config, config_file)
+
+    server_process = subprocess.Popen([sys.executable, SERVER_PY, '--config', config_file.name],
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(config["port"])
+        calibration = time_calls(calibration_loop, CALIBRATION_CALLS) / CALIBRATION_CALLS
+        stats = asyncio.run(loadgen.run({"port": config["port"], "players": player_count, "timeout_seconds": 30}))
+        if stats["finished"] != player_count:
+            raise RuntimeError(f"only {stats['finished']} of {player_count} players finished: {dict(stats['failures'])}")
+        return stats["elapsed_ns"], round(stats["elapsed_ns"] / calibration, 4)
+    finally:
+        server_process.terminate()
+        server_process.wait(timeout=5)
+        os.unlink(config_file.name)
+
+
+def wait_for_port(port, timeout=5.0):
+    # The server is ready once it accepts a connection, a fixed sleep would add to every game measured
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.02)
+
+
+def load_baseline():
+    if not os.path.exists(BASELINE_JSON):
+        return {"tolerance": 0.5, "results": {}, "relative": {}}
+    with open(BASELINE_JSON, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def save_baseline(run):
+    baseline = load_baseline()
+    if baseline.get("machine") != run["machine"]:  # numbers from another machine can't be mixed with these
+        baseline["results"], baseline["relative"] = {}, {}
+    baseline["machine"] = run["machine"]
+    baseline["results"].update(run["results"])  # a --quick run keeps the stored numbers it didn't measure
+    baseline["relative"].update(run["relative"])
+    with open(BASELINE_JSON, "w", encoding="utf-8") as file:
+        json.dump(baseline, file, indent=2)
+        file.write("\n")
+
+
+def compare(relative, baseline):
+    # Fraction slower than the baseline a result may be, "tolerances" overrides it for noisier benchmarks
+    regressions = []
+    for name, value in relative.items():
+        expected = baseline.get("relative", {}).get(name)
+        if expected is None:
+            continue
+        tolerance = baseline.get("tolerances", {}).get(name, baseline["tolerance"])
+        if value > expected * (1 + tolerance):
+            regressions.append(f"{name}: {value:.4f} calibration loops, baseline {expected:.4f}")
+    return regressions
+
+
+def format_ns(value):
+    if value >= 1e6:
+        return f"{value / 1e6:.2f} ms"
+    if value >= 1e3:
+        return f"{value / 1e3:.2f} us"
+    return f"{value} ns"
+
+
+if __name__ == "__main__":
+    main()
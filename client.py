@@ -1,3 +1,5 @@
+import atexit
+import http.client
 import json
 import sys
 import socket
@@ -5,15 +7,27 @@ import threading
 from pathlib import Path
 import queue
 import signal
-import requests
+import time
+import answer_cache
+import framing
+import leaderboard
+import ollama_client
+import questions
 
 connected = threading.Event()
 question_queue = queue.Queue()
+standings = leaderboard.RemoteStandings()  # rebuilt from LEADERBOARD deltas, replaced on every connect
+cache = None  # AnswerCache for AI mode, only with "answer_cache" in ollama_config
 
 
 def main():
+    global standings
+    global cache
     config = load_config()
     sock = None
+    if config.get("client_mode") == "ai":  # the model loads while the player connects, not on the first question
+        threading.Thread(target=load_ollama_model, args=(config["ollama_config"],), daemon=True).start()
+        cache = create_answer_cache(config["ollama_config"])
     users_command = ""
 
     while True:
@@ -30,7 +44,8 @@ def main():
                 sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
                 sock.connect((host, int(port)))
                 users_command = ""  # reset to avoid looping through connect condition
-                send_json(sock, {"message_type": "HI", "username": config["username"]})
+                standings = leaderboard.RemoteStandings()
+                send_json(sock, build_hi_message(config))
                 connected.set()
                 threading.Thread(target=receive_loop, args=(sock, config), daemon=True).start()
             except Exception:
@@ -55,7 +70,8 @@ def main():
 
                 if message["message_type"] == "QUESTION":
                     if client_mode == "ai":
-                        answer = ask_ollama(config["ollama_config"], message["short_question"], message["time_limit"])
+                        answer = ask_ollama(config["ollama_config"], message["short_question"], message["time_limit"],
+                                            message["question_type"])
                     else:
                         answer = input_handler_with_timeouts(message["time_limit"])
                     if answer is not None:
@@ -96,9 +112,19 @@ def load_config():
         sys.stderr.write("client.py: Missing values for Ollama configuration\n")
         sys.exit(1)
 
+    questions.load_question_plugins(config_file.get("question_plugins", []))  # same extra types as the server
+
     return config_file
 
 
+def build_hi_message(config):
+    hi_message = {"message_type": "HI", "username": config["username"], "leaderboard": "delta",
+                  "protocol": "compact"}  # servers without compact frames ignore it and keep sending JSON lines
+    if config.get("room") is not None:  # optional, without it the server matches the player into the next open room
+        hi_message["room"] = config["room"]
+    return hi_message
+
+
 def input_handler_with_timeouts(time_limit):
     # Signal used to break out of an input after timeout
     def timeout_handler(signum, frame):
@@ -118,22 +144,20 @@ def input_handler_with_timeouts(time_limit):
 
 
 def send_json(sock, message):
-    sock.sendall(json.dumps(message).encode("utf-8") + b"\n")
+    sock.sendall(framing.encode_message(message))
 
 
 def receive_loop(sock, config):
     # receives messages form server to then send to handle_message for processing
+    buffer = framing.MessageBuffer(framing.MAX_SERVER_FRAME_SIZE)  # holds partial frames until the rest arrives
     while True:
         if not connected.is_set():  # exit on disconnecting with client
             break
 
         try:
-            data = sock.recv(4096)
-            if not data:
+            if not framing.receive_into(sock, buffer):
                 break
-            for line in data.decode("utf-8").splitlines():
-                message = json.loads(line)
-
+            for message in buffer.messages():
                 # Handle other messages in thread
                 handle_message(sock, message, config)
         except Exception:
@@ -166,134 +190,92 @@ def handle_message(sock, message, config):
         print(message["feedback"])
 
     elif message_type == "LEADERBOARD":
-        print(message["state"])
+        if "state" in message:  # full text, from a server without delta updates
+            print(message["state"])
+            return
+
+        state = standings.apply(message)
+        if state is None:  # missed a round, ask for every entry again
+            send_json(sock, {"message_type": "LEADERBOARD_REQUEST"})
+        else:
+            print(state)
 
     elif message_type == "FINISHED":
         print(message["final_standings"])
         connected.clear()
 
 
-def ask_ollama(ollama_config, short_question, time_limit):
-    # Meant to use signal to timeout response. Note: does not break out properly, annoying bug
-    def timeout_handler(signum, frame):
-        raise TimeoutError
+def ask_ollama(ollama_config, short_question, time_limit, question_type=None):
+    # Asks the model over a reused connection, giving up with None once time_limit seconds have passed
+    model = ollama_config["ollama_model"]
+    if cache is not None and question_type is not None:
+        answer = cache.get(model, question_type, short_question)
+        if answer is not None:
+            return answer
 
-    signal.signal(signal.SIGALRM, timeout_handler)
-    signal.setitimer(signal.ITIMER_REAL, time_limit)
+    # Only the answer the reply contains is sent, with "ollama_stream" (the default) as soon as it has been generated
+    prompt = f'Evaluate {short_question}. No extra output'
+    extract = None
+    if question_type is not None:
+        prompt = f"{question_type}: {prompt}"  # both subnet question types look alike without it
+        extract = lambda text, done: questions.extract_answer(question_type, text, done)
 
+    deadline = time.monotonic() + time_limit
     try:
-        host = ollama_config["ollama_host"]
-        port = ollama_config["ollama_port"]
-        model = ollama_config["ollama_model"]
-
-        url = f"http://{host}:{port}/api/chat"
-        headers = {"Content-Type": "application/json"}
-
-        payload = {
-            "model": model,
-            "messages": [
-                {"role": "user", "content": f'Evaluate {short_question}. No extra output'}
-            ],
-            "stream": False
-        }
-
-        response = requests.post(url, headers=headers, json=payload, timeout=time_limit)
-        signal.setitimer(signal.ITIMER_REAL, 0)  # Cancel timeout
-        response.raise_for_status()  # raise error if request failed
-        data = response.json()
-        return data["message"]["content"]
-    except:
+        client = ollama_client.get_client(ollama_config)
+        answer = client.chat(model, prompt, deadline,
+                             keep_alive=ollama_config.get("ollama_keep_alive"),
+                             stream=ollama_config.get("ollama_stream", True), extract=extract)
+    except (ollama_client.DeadlineExceeded, OSError, ValueError, KeyError, http.client.HTTPException):
         return None
-    finally:
-        signal.setitimer(signal.ITIMER_REAL, 0)
 
+    # Only answers graded correct are kept, a wrong or wordy reply is asked again next time instead of repeated
+    if cache is not None and question_type is not None and is_correct(question_type, short_question, answer):
+        cache.put(model, question_type, short_question, answer)
+    return answer
 
-def evaluate_answer(question_type, short_question):
-    # Auto modes question solving logic
-    if question_type == "Mathematics":
-        try:
-            question_tokens = short_question.split()
-            total = int(question_tokens[0])  # first number in equation
-            i = 1
-            while i < len(question_tokens):
-                operation = question_tokens[i]
-                number = int(question_tokens[i + 1])
-                if operation == "+":
-                    total += number
-                elif operation == "-":
-                    total -= number
-                else:
-                    return "", False
-                i += 2
-            correct = str(total)
-        except:
-            return "", False
-
-    elif question_type == "Roman Numerals":
-        try:
-            values = {
-                'I': 1, 'V': 5, 'X': 10, 'L': 50,
-                'C': 100, 'D': 500, 'M': 1000
-            }
-            total = 0
-            prev = 0
-            for char in reversed(short_question):
-                value = values.get(char, 0)
-                if value < prev:
-                    total -= value
-                else:
-                    total += value
-                    prev = value
-            correct = str(total)
-        except:
-            correct = ""
-
-    elif question_type == "Usable IP Addresses of a Subnet":
-        try:
-            ip, prefix = short_question.split("/")
-            prefix = int(prefix)
-            if prefix < 0 or prefix > 32:
-                return ""
-            total = 2 ** (32 - prefix)
-            usable = total - 2 if prefix < 31 else total  # handle special cases
-            correct = str(usable)
-        except:
-            correct = ""
 
-    elif question_type == "Network and Broadcast Address of a Subnet":
-        correct = solve_network_broadcast(short_question)
-
-    else:
-        correct = ""
+def create_answer_cache(ollama_config):
+    # "answer_cache": {"max_entries": n, "ttl_seconds": s, "path": file kept between runs, "preseed": true}
+    settings = ollama_config.get("answer_cache")
+    if settings is None:
+        return None
 
-    return correct
+    answers = answer_cache.AnswerCache(settings.get("max_entries", answer_cache.MAX_ENTRIES),
+                                       settings.get("ttl_seconds", answer_cache.TTL_SECONDS), settings.get("path"))
+    answers.load()
+    if settings.get("preseed"):
+        answers.preseed(ollama_config["ollama_model"], "Usable IP Addresses of a Subnet",
+                              answer_cache.usable_address_questions(), evaluate_answer)
+    atexit.register(save_answer_cache, answers)
+    return answers
 
 
-def solve_network_broadcast(short_question):
+def save_answer_cache(answers):
     try:
-        ip_str, prefix = short_question.split("/")
-        prefix = int(prefix)
-        if prefix < 0 or prefix > 32:
-            return ""
+        answers.save()
+    except OSError:
+        sys.stderr.write(f"client.py: Could not save answer cache to {answers.path}\n")
+    stats = answers.stats()
+    print(f"Answer cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries")
 
-        # Convert IP to integer
-        ip_parts = list(map(int, ip_str.split(".")))
-        ip_int = (ip_parts[0] << 24) | (ip_parts[1] << 16) | (ip_parts[2] << 8) | ip_parts[3]
 
-        # Create subnet mask
-        mask = (0xFFFFFFFF << (32 - prefix)) & 0xFFFFFFFF
+def load_ollama_model(ollama_config):
+    try:
+        ollama_client.get_client(ollama_config).load_model(ollama_config["ollama_model"],
+                                                           ollama_config.get("ollama_keep_alive"))
+    except (ollama_client.DeadlineExceeded, OSError, ValueError, http.client.HTTPException):
+        pass  # the first question loads it instead
 
-        # Calculate network and broadcast
-        net_int = ip_int & mask
-        broadcast_int = ip_int | (~mask & 0xFFFFFFFF)
 
-        # Convert back to dotted format
-        def int_to_ip(n):
-            return f"{(n >> 24) & 0xFF}.{(n >> 16) & 0xFF}.{(n >> 8) & 0xFF}.{n & 0xFF}"
+def evaluate_answer(question_type, short_question):
+    # Auto modes question solving logic, shared with the server through the question type registry
+    return questions.solve_answer(question_type, short_question)
+
 
-        return f"{int_to_ip(net_int)} and {int_to_ip(broadcast_int)}"
-    except:
-        return ""
+def is_correct(question_type, short_question, answer):
+    # Graded the way the server grades it
+    return questions.Question(question_type, short_question).is_correct(answer)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,68 @@
+import json
+import queue
+import threading
+import time
+
+# Append only JSONL log of every game, replayed by replay.py. Recording only puts a dict on a queue, a background
+# thread encodes and writes whatever has piled up in one go, so a slow disk never holds up a game
+
+BATCH_SIZE = 1024  # most events encoded and written per write call
+
+LOG = None  # the open EventLog, set by open_log, recording is a no-op without one
+
+
+class EventLog:
+
+    def __init__(self, path):
+        self.file = open(path, "a", encoding="utf-8")
+        self.queue = queue.SimpleQueue()
+        self.writer = threading.Thread(target=self.write_loop, daemon=True)
+        self.writer.start()
+
+    def write_loop(self):
+        while True:
+            events = [self.queue.get()]  # wait for the first event, then take everything else already queued
+            while len(events) < BATCH_SIZE:
+                try:
+                    events.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            self.file.write("".join(json.dumps(event) + "\n" for event in events if event is not None))
+            self.file.flush()
+            if None in events:  # close was called
+                self.file.close()
+                return
+
+    def close(self):
+        self.queue.put(None)
+        self.writer.join()
+
+
+def open_log(path):
+    global LOG
+    LOG = EventLog(path)
+    return LOG
+
+
+def close_log():
+    global LOG
+    if LOG is not None:
+        LOG.close()
+        LOG = None
+
+
+def record(event, **fields):
+    log = LOG
+    if log is None:
+        return
+    fields["event"] = event
+    fields["time"] = time.time()
+    log.queue.put(fields)  # the dict is encoded later on the writer thread, callers must not change it afterwards
+
+
+def read_events(path):
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
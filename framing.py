@@ -0,0 +1,252 @@
+import json
+import struct
+
+MAX_FRAME_SIZE = 64 * 1024  # most a client may send in one frame, its messages are short so more is a misbehaving peer
+# Most the server may send in one frame. FINISHED and full LEADERBOARD frames list every player, passing 64 KB from a
+# few thousand players, so readers of the server only guard against a broken stream
+MAX_SERVER_FRAME_SIZE = 256 * 1024 * 1024
+RECV_SIZE = 4096
+
+
+class FrameTooLarge(ValueError):
+    pass
+
+
+class LineBuffer:
+    # Incremental buffer for newline delimited JSON, keeps partial lines between recv calls
+
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE, on_malformed=None):
+        self.max_frame_size = max_frame_size
+        self.on_malformed = on_malformed  # called with each frame that isn't a valid message, which is then skipped
+        self.buffer = bytearray()
+        self.start = 0  # index of the first byte not yet handed out as a frame
+        self.scanned = 0  # bytes already searched for a newline, so a long partial line isn't rescanned
+
+    def feed(self, data):
+        if self.start and self.start >= len(self.buffer) // 2:  # compact only once half the buffer is consumed
+            del self.buffer[:self.start]
+            self.scanned -= self.start
+            self.start = 0
+
+        self.buffer += data
+
+    def next_frame(self):
+        # Returns the next complete line without its newline, or None if only a partial line is buffered
+        end = self.buffer.find(b"\n", max(self.start, self.scanned))
+        if end == -1:
+            self.scanned = len(self.buffer)
+            if self.scanned - self.start > self.max_frame_size:
+                raise FrameTooLarge(f"frame exceeds {self.max_frame_size} bytes")
+            return None
+
+        if end - self.start > self.max_frame_size:
+            raise FrameTooLarge(f"frame exceeds {self.max_frame_size} bytes")
+
+        with memoryview(self.buffer) as view:
+            frame = bytes(view[self.start:end])  # single copy out of the shared buffer
+        self.start = end + 1
+        self.scanned = self.start
+        return frame
+
+    def messages(self):
+        # Yields every complete JSON message currently buffered, anything not yet yielded stays buffered
+        while True:
+            frame = self.next_frame()
+            if frame is None:
+                return
+            if not frame.strip():
+                continue
+            message = self.decode_json(frame)
+            if message is not None:
+                yield message
+
+    def pending(self):
+        return len(self.buffer) - self.start
+
+    def decode_json(self, frame):
+        # Every message is a JSON object, anything else (a bad line, 5, []) is skipped rather than ending the connection
+        try:
+            message = json.loads(frame)
+        except ValueError:
+            message = None
+        if not isinstance(message, dict):
+            self.malformed(frame)
+            return None
+        return message
+
+    def malformed(self, frame):
+        if self.on_malformed is not None:
+            self.on_malformed(frame)
+
+
+class MessageBuffer(LineBuffer):
+    # Reads compact frames and JSON lines from the same stream, whichever the server chose to send
+
+    def next_frame(self):
+        if self.pending() and self.buffer[self.start] == COMPACT_MARKER:
+            return self.next_compact_frame()
+        return super().next_frame()
+
+    def next_compact_frame(self):
+        if self.pending() < COMPACT_HEADER.size:
+            return None
+        _, length = COMPACT_HEADER.unpack_from(self.buffer, self.start)
+        if length > self.max_frame_size:
+            raise FrameTooLarge(f"frame exceeds {self.max_frame_size} bytes")
+        end = self.start + COMPACT_HEADER.size + length
+        if len(self.buffer) < end:
+            return None
+
+        with memoryview(self.buffer) as view:
+            frame = bytes(view[self.start:end])
+        self.start = end
+        self.scanned = self.start
+        return frame
+
+    def messages(self):
+        while True:
+            frame = self.next_frame()
+            if frame is None:
+                return
+            if frame[:1] == bytes((COMPACT_MARKER,)):
+                try:
+                    yield decode_compact(frame[COMPACT_HEADER.size:])
+                except (ValueError, IndexError, struct.error):
+                    self.malformed(frame)
+                continue
+            if not frame.strip():
+                continue
+            message = self.decode_json(frame)
+            if message is not None:
+                yield message
+
+
+def encode_message(message):
+    return json.dumps(message).encode("utf-8") + b"\n"
+
+
+# Compact frames, sent to clients that ask for "protocol": "compact" in HI. A frame is a marker byte (never "{" or
+# valid UTF-8, so a reader can tell it apart from a JSON line), the body length and the body. The body is the message
+# type code, then each field as a key code, a value tag and the value. Nested lists and dicts are compact JSON
+
+COMPACT_MARKER = 0xC1
+COMPACT_HEADER = struct.Struct(">BI")
+MESSAGE_TYPES = ["READY", "QUESTION", "RESULT", "LEADERBOARD", "FINISHED"]  # codes start at 1, 0 spells the type out
+KEYS = ["info", "question_type", "trivia_question", "short_question", "time_limit", "correct", "feedback", "points",
+        "latency_ms", "state", "round", "entries", "changes", "top", "points_nouns", "player_id", "final_standings"]
+MESSAGE_TYPE_CODES = {message_type: code for code, message_type in enumerate(MESSAGE_TYPES, 1)}
+KEY_CODES = {key: code for code, key in enumerate(KEYS, 1)}
+
+TAG_NONE, TAG_FALSE, TAG_TRUE, TAG_INT, TAG_FLOAT, TAG_STR, TAG_JSON = range(7)
+INT = struct.Struct(">q")
+FLOAT = struct.Struct(">d")
+LENGTH = struct.Struct(">I")
+
+
+def encode_compact(message):
+    message_type = message.get("message_type")
+    code = MESSAGE_TYPE_CODES.get(message_type, 0)
+    parts = [bytes((code,))]
+    if not code:
+        parts.append(encode_compact_value(message_type))
+
+    for key, value in message.items():
+        if key != "message_type":
+            parts.append(encode_compact_field(key, value))
+
+    body = b"".join(parts)
+    return COMPACT_HEADER.pack(COMPACT_MARKER, len(body)) + body
+
+
+def encode_compact_field(key, value):
+    key_code = KEY_CODES.get(key, 0)
+    if key_code:
+        return bytes((key_code,)) + encode_compact_value(value)
+    return b"\x00" + encode_compact_value(key) + encode_compact_value(value)  # key not in the table, spelled out
+
+
+def encode_compact_value(value):
+    if value is None:
+        return bytes((TAG_NONE,))
+    if value is True or value is False:
+        return bytes((TAG_TRUE if value else TAG_FALSE,))
+    if isinstance(value, int) and -2 ** 63 <= value < 2 ** 63:
+        return bytes((TAG_INT,)) + INT.pack(value)
+    if isinstance(value, float):
+        return bytes((TAG_FLOAT,)) + FLOAT.pack(value)
+    if isinstance(value, str):
+        encoded = value.encode("utf-8")
+        return bytes((TAG_STR,)) + LENGTH.pack(len(encoded)) + encoded
+    encoded = json.dumps(value, separators=(",", ":")).encode("utf-8")
+    return bytes((TAG_JSON,)) + LENGTH.pack(len(encoded)) + encoded
+
+
+def add_compact_field(payload, key, value):
+    # Adds one field to an already encoded frame, so a shared frame needs no second encoding for one extra field
+    field = encode_compact_field(key, value)
+    body_start = COMPACT_HEADER.size + 1 + (0 if payload[COMPACT_HEADER.size] else
+                                            LENGTH.unpack_from(payload, COMPACT_HEADER.size + 2)[0] + 5)
+    body_length = len(payload) - COMPACT_HEADER.size + len(field)
+    return (COMPACT_HEADER.pack(COMPACT_MARKER, body_length) + payload[COMPACT_HEADER.size:body_start] + field +
+            payload[body_start:])
+
+
+def decode_compact(body):
+    with memoryview(body) as view:
+        code = view[0]
+        offset = 1
+        if code:
+            message = {"message_type": MESSAGE_TYPES[code - 1]}
+        else:
+            message_type, offset = decode_compact_value(view, offset)
+            message = {"message_type": message_type}
+
+        while offset < len(view):
+            key_code = view[offset]
+            offset += 1
+            if key_code:
+                key = KEYS[key_code - 1]
+            else:
+                key, offset = decode_compact_value(view, offset)
+            message[key], offset = decode_compact_value(view, offset)
+    return message
+
+
+def decode_compact_value(view, offset):
+    tag = view[offset]
+    offset += 1
+    if tag == TAG_NONE:
+        return None, offset
+    if tag == TAG_FALSE or tag == TAG_TRUE:
+        return tag == TAG_TRUE, offset
+    if tag == TAG_INT:
+        return INT.unpack_from(view, offset)[0], offset + INT.size
+    if tag == TAG_FLOAT:
+        return FLOAT.unpack_from(view, offset)[0], offset + FLOAT.size
+
+    length = LENGTH.unpack_from(view, offset)[0]
+    start = offset + LENGTH.size
+    text = str(view[start:start + length], "utf-8")
+    if tag == TAG_STR:
+        return text, start + length
+    return json.loads(text), start + length
+
+
+ENCODERS = {"json": encode_message, "compact": encode_compact}
+
+
+def encode_for(protocol, message, encoded):
+    # Encodes message once per protocol, encoded is a dict shared by everyone receiving the same message
+    payload = encoded.get(protocol)
+    if payload is None:
+        payload = encoded[protocol] = ENCODERS[protocol](message)
+    return payload
+
+
+def receive_into(connection, buffer):
+    # Reads once from a socket into its buffer, returns False once the peer has closed the connection
+    data = connection.recv(RECV_SIZE)
+    if not data:
+        return False
+    buffer.feed(data)
+    return True
@@ -0,0 +1,127 @@
+import selectors
+import time
+import framing
+import metrics
+
+HANDSHAKE_SIZE = framing.MAX_FRAME_SIZE + framing.RECV_SIZE  # HI plus anything read in the same recv calls
+ACCEPT_RETRY_SECONDS = 0.1  # how long a listener is left alone after accept failed, e.g. out of file descriptors
+
+
+class HandshakeLoop:
+    # One thread reads HI from every new connection at once through a selector, instead of a thread per connection.
+    # Players waiting for their room to fill stay registered, so a disconnect shows up as a read event straight away.
+
+    def __init__(self, on_hello):
+        self.on_hello = on_hello  # on_hello(connection, buffer, message, received) once a connection sends HI
+        self.selector = selectors.DefaultSelector()
+        self.paused = []  # (monotonic time to resume, listener) for listeners taken off the selector by accept
+        self.running = True
+
+    def add_listener(self, listener):
+        listener.setblocking(False)
+        self.add_source(listener, lambda: self.accept(listener))
+
+    def add_source(self, fileobj, callback):
+        # Anything else worth waking up for, e.g. the channel sockets are handed over on in a worker
+        self.selector.register(fileobj, selectors.EVENT_READ, callback)
+
+    def add_connection(self, connection, received=b""):
+        connection.setblocking(False)
+        state = {"connection": connection, "buffer": framing.LineBuffer(on_malformed=count_malformed),
+                 "received": bytearray(received)}
+        state["buffer"].feed(received)  # bytes already read by a dispatcher process before handing the socket over
+        self.selector.register(connection, selectors.EVENT_READ, lambda: self.read_hello(state))
+        self.check_hello(state)
+
+    def watch(self, connection, buffer, on_close):
+        # Keeps reading a joined player until forget, anything they send stays in their buffer for the game
+        def read():
+            try:
+                connected = framing.receive_into(connection, buffer)
+                connected = connected and buffer.pending() <= HANDSHAKE_SIZE  # flooding while waiting counts as gone
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                connected = False
+            if not connected:
+                self.forget(connection)
+                on_close()
+
+        self.selector.register(connection, selectors.EVENT_READ, read)
+
+    def forget(self, connection):
+        try:
+            self.selector.unregister(connection)
+        except (KeyError, ValueError):
+            pass
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        try:
+            while self.running:
+                timeout = max(0.0, self.paused[0][0] - time.monotonic()) if self.paused else None
+                for key, _ in self.selector.select(timeout):
+                    key.data()
+                self.resume_listeners()
+        finally:
+            self.selector.close()
+
+    def accept(self, listener):
+        # Takes every connection waiting in the backlog, a burst of clients is admitted in one wake up
+        while True:
+            try:
+                connection, address = listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                # e.g. out of file descriptors, the connection stays in the backlog so the listener would wake this
+                # loop again straight away, it sits out for a moment instead
+                self.forget(listener)
+                self.paused.append((time.monotonic() + ACCEPT_RETRY_SECONDS, listener))
+                return
+            metrics.ACCEPTS.inc()
+            self.add_connection(connection)
+
+    def resume_listeners(self):
+        now = time.monotonic()
+        while self.paused and self.paused[0][0] <= now:
+            _, listener = self.paused.pop(0)
+            self.add_listener(listener)
+
+    def read_hello(self, state):
+        connection = state["connection"]
+        try:
+            data = connection.recv(framing.RECV_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+
+        if not data or len(state["received"]) + len(data) > HANDSHAKE_SIZE:
+            self.forget(connection)
+            connection.close()
+            return
+
+        state["received"] += data
+        state["buffer"].feed(data)
+        self.check_hello(state)
+
+    def check_hello(self, state):
+        connection = state["connection"]
+        try:
+            for message in state["buffer"].messages():
+                if message.get("message_type") == "HI":
+                    self.forget(connection)  # on_hello decides whether to keep watching it
+                    self.on_hello(connection, state["buffer"], message, bytes(state["received"]))
+                    return
+        except framing.FrameTooLarge:
+            metrics.DROPPED_TOO_LARGE.inc()
+            self.forget(connection)
+            connection.close()
+
+
+def count_malformed(frame):
+    # The buffer stays with the player for the whole game, so every malformed frame a player sends is counted here
+    metrics.DROPPED_MALFORMED.inc()
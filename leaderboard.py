@@ -0,0 +1,148 @@
+import bisect
+import itertools
+
+
+class Leaderboard:
+    # Players grouped into score buckets that are updated as scores change, instead of sorting the room every round.
+    # Order matches sorted(players, key=lambda p: (-p["score"], p["username"])), ties share a rank like 1, 1, 3.
+
+    def __init__(self):
+        self.players = {}  # key -> player, key is (username, join number) so repeated usernames stay distinct
+        self.bucketed = {}  # key -> score the player is currently filed under
+        self.buckets = {}  # score -> sorted keys of players on that score
+        self.scores = []  # distinct scores, ascending
+        self.above = None  # score -> players with a higher score, rebuilt lazily after any change
+        self.join_numbers = itertools.count()
+        self.changed = set()  # keys whose score moved since take_changes, sent to clients as a delta
+
+    def __len__(self):
+        return len(self.players)
+
+    def add(self, player, number=None):
+        # number keeps a clients copy in the same order as the server, which hands out join numbers itself
+        key = (str(player["username"]), next(self.join_numbers) if number is None else number)
+        player["leaderboard_key"] = key
+        self.players[key] = player
+        self.insert(key, player["score"])
+
+    def remove(self, player):
+        key = player["leaderboard_key"]
+        self.discard(key)
+        self.changed.discard(key)
+        del self.players[key]
+
+    def update(self, player):
+        # Call after changing player["score"], moves them to their new bucket
+        key = player["leaderboard_key"]
+        if self.bucketed[key] != player["score"]:
+            self.discard(key)
+            self.insert(key, player["score"])
+            self.changed.add(key)
+
+    def take_changes(self):
+        # [join number, score] for every player whose score moved since the last call, ranks are left to the client
+        changes = sorted([key[1], self.bucketed[key]] for key in self.changed)
+        self.changed.clear()
+        return changes
+
+    def rank(self, player):
+        return self.ranks_above()[self.bucketed[player["leaderboard_key"]]] + 1
+
+    def position(self, player):
+        # Index of the player in the full ordered standings
+        key = player["leaderboard_key"]
+        score = self.bucketed[key]
+        return self.ranks_above()[score] + bisect.bisect_left(self.buckets[score], key)
+
+    def ranked(self, limit=None):
+        # Yields (rank, player, score) from the top, stopping after limit players
+        count = 0
+        for score in reversed(self.scores):
+            rank = count + 1
+            for key in self.buckets[score]:
+                if limit is not None and count >= limit:
+                    return
+                yield rank, self.players[key], score
+                count += 1
+
+    def winners(self):
+        if not self.scores:
+            return []
+        return [self.players[key] for key in self.buckets[self.scores[-1]]]
+
+    def insert(self, key, score):
+        bucket = self.buckets.get(score)
+        if bucket is None:
+            bucket = self.buckets[score] = []
+            bisect.insort(self.scores, score)
+        bisect.insort(bucket, key)
+        self.bucketed[key] = score
+        self.above = None
+
+    def discard(self, key):
+        score = self.bucketed.pop(key)
+        bucket = self.buckets[score]
+        del bucket[bisect.bisect_left(bucket, key)]
+        if not bucket:
+            del self.buckets[score]
+            del self.scores[bisect.bisect_left(self.scores, score)]
+        self.above = None
+
+    def ranks_above(self):
+        if self.above is None:
+            self.above = {}
+            count = 0
+            for score in reversed(self.scores):
+                self.above[score] = count
+                count += len(self.buckets[score])
+        return self.above
+
+
+def format_standing(rank, username, score, noun_singular, noun_plural):
+    noun = noun_singular if score == 1 else noun_plural
+    return f"{rank}. {username}: {score} {noun}"
+
+
+class RemoteStandings:
+    # Client side copy of a rooms standings, rebuilt from LEADERBOARD snapshots and deltas into the servers text
+
+    def __init__(self):
+        self.leaderboard = None
+        self.players = {}  # join number -> player
+        self.round = None
+        self.player_id = None
+        self.top = None
+        self.nouns = ("point", "points")
+
+    def apply(self, message):
+        # Returns the standings text, or None when a delta doesn't follow the last round and a snapshot is needed
+        if "entries" in message:
+            self.leaderboard = Leaderboard()
+            self.players = {}
+            for number, username, score in message["entries"]:
+                player = {"username": username, "score": score}
+                self.players[number] = player
+                self.leaderboard.add(player, number)
+            self.player_id = message.get("player_id", self.player_id)  # only sent until the client knows it
+            self.top = message.get("top")
+            self.nouns = tuple(message["points_nouns"])
+        elif self.leaderboard is None or message.get("round") != self.round + 1:
+            return None
+        else:
+            for number, score in message["changes"]:
+                player = self.players[number]
+                player["score"] = score
+                self.leaderboard.update(player)
+
+        self.round = message.get("round")
+        return self.render()
+
+    def render(self):
+        lines = [format_standing(rank, player["username"], score, *self.nouns)
+                 for rank, player, score in self.leaderboard.ranked(self.top)]
+
+        own = self.players.get(self.player_id)
+        if self.top is not None and own is not None and self.leaderboard.position(own) >= self.top:
+            lines.append("...")
+            lines.append(format_standing(self.leaderboard.rank(own), own["username"], own["score"], *self.nouns))
+        return "\n".join(lines)
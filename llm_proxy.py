@@ -0,0 +1,306 @@
+import http.client
+import json
+import select
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import metrics
+import ollama_client
+
+# Local proxy in front of Ollama's /api/chat for many AI players on one host. Identical requests already in flight
+# share one upstream call, whose streamed lines are copied to every waiting player, and upstream calls beyond
+# "max_concurrency" wait in a queue. The upstream call is abandoned once every player waiting on it has hung up
+# Usage: python llm_proxy.py --config <proxy config>, stats are served on the same port at /metrics
+
+REGISTRY = metrics.Registry()  # the proxy's own metrics, not the game server's
+REQUESTS = REGISTRY.counter("llm_proxy_requests_total", "Chat requests received from players")
+COALESCED = REGISTRY.counter("llm_proxy_coalesced_total", "Requests answered by an identical request in flight")
+UPSTREAM_REQUESTS = REGISTRY.counter("llm_proxy_upstream_requests_total", "Chat requests sent upstream")
+UPSTREAM_ERRORS = REGISTRY.counter("llm_proxy_upstream_errors_total", "Upstream requests that failed")
+UPSTREAM_ABANDONED = REGISTRY.counter("llm_proxy_upstream_abandoned_total",
+                                      "Upstream requests stopped because every waiting player hung up")
+QUEUE_DEPTH = REGISTRY.gauge("llm_proxy_queue_depth", "Upstream requests waiting for a free slot")
+UPSTREAM_ACTIVE = REGISTRY.gauge("llm_proxy_upstream_active", "Upstream requests running")
+REQUEST_SECONDS = REGISTRY.histogram("llm_proxy_request_seconds", "Request received until its reply was written")
+QUEUE_SECONDS = REGISTRY.histogram("llm_proxy_queue_seconds", "Time an upstream request waited for a free slot")
+UPSTREAM_SECONDS = REGISTRY.histogram("llm_proxy_upstream_seconds", "Upstream request sent until its reply ended")
+
+UNCOALESCED_FIELDS = ("stream", "keep_alive")  # requests differing only in these share an upstream call
+HANG_UP_CHECK_SECONDS = 0.1  # how often a player waiting for more of the reply is checked for having hung up
+
+
+class Flight:
+    # One upstream call and the reply lines received for it so far
+
+    def __init__(self, key, payload):
+        self.key = key
+        self.payload = payload
+        self.lines = []
+        self.done = False
+        self.error = None
+        self.waiters = 0  # players waiting on this reply, changed under the proxy lock
+        self.sock = None  # upstream socket, once the request was sent
+        self.condition = threading.Condition()
+
+    def add_line(self, line):
+        with self.condition:
+            self.lines.append(line)
+            self.condition.notify_all()
+
+    def finish(self, error=None):
+        with self.condition:
+            self.done = True
+            self.error = error
+            self.condition.notify_all()
+
+    def wait_lines(self, start, timeout=None):
+        # Lines after the first start ones, waiting until there is one, the reply ended or timeout passed
+        with self.condition:
+            if len(self.lines) <= start and not self.done:
+                self.condition.wait(timeout)
+            return self.lines[start:], self.done
+
+
+class Proxy:
+
+    def __init__(self, config):
+        self.upstream = ollama_client.OllamaClient(config.get("upstream_host", "127.0.0.1"),
+                                                   config.get("upstream_port", 11434),
+                                                   config.get("max_concurrency", 1))
+        self.timeout = config.get("upstream_timeout_seconds", 120)
+        self.slots = threading.Semaphore(config.get("max_concurrency", 1))
+        self.flights = {}  # request key -> Flight in progress
+        self.lock = threading.Lock()
+
+    def join(self, payload):
+        key = json.dumps({field: value for field, value in payload.items() if field not in UNCOALESCED_FIELDS},
+                         sort_keys=True)
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is None:
+                flight = self.flights[key] = Flight(key, payload)
+                threading.Thread(target=self.fetch, args=(flight,), daemon=True).start()
+            else:
+                COALESCED.inc()
+            flight.waiters += 1
+        return flight
+
+    def leave(self, flight):
+        with self.lock:
+            flight.waiters -= 1
+            abandoned = not flight.waiters and not flight.done
+            if abandoned and self.flights.get(flight.key) is flight:
+                del self.flights[flight.key]  # a request arriving now starts its own call instead of joining this one
+            abandoned = abandoned and flight.sock is not None
+        if abandoned:
+            try:
+                flight.sock.shutdown(socket.SHUT_RDWR)  # wakes the upstream read, stopping the generation
+            except OSError:
+                pass
+
+    def fetch(self, flight):
+        queued = time.monotonic()
+        QUEUE_DEPTH.inc()
+        with self.slots:
+            QUEUE_DEPTH.dec()
+            QUEUE_SECONDS.observe(time.monotonic() - queued)
+            with self.lock:
+                waiting = flight.waiters
+            if not waiting:  # every player hung up while it was queued, leave already removed it
+                UPSTREAM_ABANDONED.inc()
+                flight.finish("abandoned")
+                return
+            UPSTREAM_ACTIVE.inc()
+            UPSTREAM_REQUESTS.inc()
+            start = time.monotonic()
+            error = None
+            try:
+                self.upstream.post("/api/chat", dict(flight.payload, stream=True), start + self.timeout,
+                                   lambda *args: self.relay(flight, *args))
+            except (ollama_client.DeadlineExceeded, OSError, http.client.HTTPException) as exception:
+                UPSTREAM_ERRORS.inc()
+                error = str(exception) or type(exception).__name__
+            finally:
+                UPSTREAM_ACTIVE.dec()
+                UPSTREAM_SECONDS.observe(time.monotonic() - start)
+
+        with self.lock:  # identical requests from now on start a new upstream call
+            if self.flights.get(flight.key) is flight:
+                del self.flights[flight.key]
+        flight.finish(error)
+
+    def relay(self, flight, sock, response, deadline):
+        # Copies each upstream line to the flight as it arrives
+        with self.lock:  # leave only shuts the socket down once it can see it
+            flight.sock = sock
+            waiting = flight.waiters
+        if not waiting:
+            UPSTREAM_ABANDONED.inc()
+            return None, False
+        pending = b""
+        while True:
+            try:
+                ollama_client.set_deadline(sock, deadline)
+                chunk = response.read1(ollama_client.READ_SIZE)
+            except (OSError, http.client.HTTPException):
+                if flight.waiters:
+                    raise
+                chunk = b""  # shut down by leave
+            if not flight.waiters:
+                UPSTREAM_ABANDONED.inc()
+                return None, False  # the connection is closed, which stops the generation
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop() if chunk else b""
+            for line in lines:
+                if line.strip():
+                    flight.add_line(line)
+            if not chunk:
+                response.close()
+                return None, True
+
+
+class ProxyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # players keep their connections to the proxy open between questions
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        self.send_body(200, REGISTRY.render().encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8")
+
+    def do_POST(self):
+        if self.path != "/api/chat":
+            self.send_error(404)
+            return
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        except ValueError:
+            self.send_json(400, {"error": "request body is not JSON"})
+            return
+
+        REQUESTS.inc()
+        start = time.monotonic()
+        flight = self.server.proxy.join(payload)
+        try:
+            if payload.get("stream", True):  # Ollama streams unless told not to
+                self.stream_reply(flight)
+            else:
+                self.whole_reply(flight)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True  # the player hung up, usually because it already had its answer
+        finally:
+            self.server.proxy.leave(flight)
+            REQUEST_SECONDS.observe(time.monotonic() - start)
+
+    def stream_reply(self, flight):
+        sent = 0
+        while True:
+            lines, done = flight.wait_lines(sent, HANG_UP_CHECK_SECONDS)
+            if not lines and not done:
+                if self.hung_up():
+                    raise ConnectionResetError  # players hang up once they have their answer
+                continue
+            if done and flight.error is not None and not sent:
+                self.send_json(502, {"error": flight.error})
+                return
+            if not sent and (lines or done):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+            for line in lines:
+                self.wfile.write(b"%x\r\n%s\n\r\n" % (len(line) + 1, line))
+            sent += len(lines)
+            if done:
+                if flight.error is not None:
+                    error_line = json.dumps({"error": flight.error}).encode("utf-8")
+                    self.wfile.write(b"%x\r\n%s\n\r\n" % (len(error_line) + 1, error_line))
+                self.wfile.write(b"0\r\n\r\n")
+                return
+
+    def whole_reply(self, flight):
+        # The streamed lines put back together into the single reply Ollama gives with "stream": false
+        sent = 0
+        while True:
+            lines, done = flight.wait_lines(sent, HANG_UP_CHECK_SECONDS)
+            sent += len(lines)
+            if done:
+                break
+            if self.hung_up():
+                raise ConnectionResetError
+        if flight.error is not None:
+            self.send_json(502, {"error": flight.error})
+            return
+
+        parts = [json.loads(line) for line in flight.lines]
+        reply = dict(parts[-1]) if parts else {"done": True}
+        if parts and "message" in parts[-1]:
+            content = "".join(part.get("message", {}).get("content", "") for part in parts)
+            reply["message"] = dict(parts[-1]["message"], content=content)
+        self.send_json(200, reply)
+
+    def hung_up(self):
+        # A player's socket reads as closed once it hung up, it sends nothing else while waiting for a reply
+        readable, _, _ = select.select([self.connection], [], [], 0)
+        try:
+            return bool(readable) and not self.connection.recv(1, socket.MSG_PEEK)
+        except OSError:
+            return True
+
+    def send_json(self, status, message):
+        self.send_body(status, json.dumps(message).encode("utf-8"), "application/json")
+
+    def send_body(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class ProxyServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # a whole game of players asks at the same moment
+
+
+def create_proxy(config):
+    http_server = ProxyServer((config.get("host", "127.0.0.1"), config["port"]), ProxyHandler)
+    http_server.proxy = Proxy(config)
+    return http_server
+
+
+def load_config():
+    if "--config" not in sys.argv or sys.argv.index("--config") + 1 >= len(sys.argv):
+        sys.stderr.write("llm_proxy.py: Configuration not provided\n")
+        sys.exit(1)
+
+    config_path = Path(sys.argv[sys.argv.index("--config") + 1])
+    if not config_path.exists():
+        sys.stderr.write(f"llm_proxy.py: File {config_path} does not exist\n")
+        sys.exit(1)
+
+    with config_path.open("r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def main():
+    config = load_config()
+    try:
+        http_server = create_proxy(config)
+    except OSError:
+        sys.stderr.write(f"llm_proxy.py: Binding to port {config['port']} was unsuccessful\n")
+        sys.exit(1)
+    try:
+        http_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
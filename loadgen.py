@@ -0,0 +1,184 @@
+import asyncio
+import json
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+import framing
+from client import evaluate_answer
+
+# Simulates many auto players from one process over the real protocol, then reports how the server held up
+
+
+def main():
+    config = load_config()
+    stats = asyncio.run(run(config))
+    print_report(stats, config)
+
+
+def load_config():
+    if "--config" not in sys.argv:
+        sys.stderr.write("loadgen.py: Configuration not provided\n")
+        sys.exit(1)
+
+    config_index = sys.argv.index("--config") + 1
+    if config_index >= len(sys.argv):
+        sys.stderr.write("loadgen.py: Configuration not provided\n")
+        sys.exit(1)
+
+    config_path = Path(sys.argv[config_index])
+    if not config_path.exists():
+        sys.stderr.write(f"loadgen.py: File {config_path} does not exist\n")
+        sys.exit(1)
+
+    with config_path.open("r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+async def run(config):
+    stats = {
+        "join_ns": [],  # connect until READY, per player
+        "question_arrivals": defaultdict(list),  # question number -> monotonic arrival time at every player
+        "result_ns": [],  # ANSWER sent until RESULT received
+        "finished": 0,
+        "disconnected": 0,  # left on purpose through "disconnect_rate"
+        "bytes_received": 0,
+        "failures": Counter()
+    }
+    rng = random.Random(config.get("seed"))
+    start_ns = time.monotonic_ns()
+    players = [run_player(i, config, random.Random(rng.random()), stats) for i in range(config["players"])]
+    await asyncio.gather(*players)
+    stats["elapsed_ns"] = time.monotonic_ns() - start_ns
+    return stats
+
+
+async def run_player(index, config, rng, stats):
+    timeout = config.get("timeout_seconds", 60)
+    connect_ns = time.monotonic_ns()
+    try:
+        connection = asyncio.open_connection(config.get("host", "127.0.0.1"), config["port"],
+                                             limit=framing.MAX_SERVER_FRAME_SIZE)  # FINISHED grows with the room
+        reader, writer = await asyncio.wait_for(connection, timeout=timeout)
+    except (OSError, asyncio.TimeoutError):
+        stats["failures"]["connect"] += 1
+        return
+
+    hi_message = {"message_type": "HI", "username": f"{config.get('username_prefix', 'load')}-{index}",
+                  "leaderboard": "delta", "protocol": config.get("protocol", "json")}  # no use for the standings text
+    if config.get("room") is not None:
+        hi_message["room"] = config["room"]
+
+    try:
+        writer.write(framing.encode_message(hi_message))
+        await play(reader, writer, config, rng, stats, connect_ns, timeout)
+    except asyncio.TimeoutError:
+        stats["failures"]["timeout"] += 1
+    except (ConnectionError, OSError, ValueError, EOFError):
+        stats["failures"]["connection lost"] += 1
+    finally:
+        writer.close()
+
+
+async def play(reader, writer, config, rng, stats, connect_ns, timeout):
+    question_number = 0
+    answer_sent_ns = None
+    while True:
+        message = await asyncio.wait_for(read_message(reader, stats), timeout=timeout)
+        received_ns = time.monotonic_ns()
+        if message is None:
+            stats["failures"]["closed before FINISHED"] += 1
+            return
+
+        message_type = message.get("message_type")
+
+        if message_type == "READY":
+            stats["join_ns"].append(received_ns - connect_ns)
+
+        elif message_type == "QUESTION":
+            question_number += 1
+            stats["question_arrivals"][question_number].append(received_ns)
+            if rng.random() < config.get("disconnect_rate", 0.0):  # leaves mid game like a player closing the client
+                writer.write(framing.encode_message({"message_type": "BYE"}))
+                stats["disconnected"] += 1
+                return
+
+            await asyncio.sleep(answer_delay(config, rng, message["time_limit"]))
+            answer = evaluate_answer(message["question_type"], message["short_question"])
+            if rng.random() >= config.get("correct_rate", 1.0):
+                answer = f"wrong {answer}"
+            writer.write(framing.encode_message({"message_type": "ANSWER", "answer": answer}))
+            answer_sent_ns = time.monotonic_ns()
+
+        elif message_type == "RESULT" and answer_sent_ns is not None:
+            stats["result_ns"].append(received_ns - answer_sent_ns)
+            answer_sent_ns = None
+
+        elif message_type == "FINISHED":
+            stats["finished"] += 1
+            return
+
+
+async def read_message(reader, stats):
+    # Next message in either wire format, None once the server closed the connection
+    try:
+        first = await reader.readexactly(1)
+    except asyncio.IncompleteReadError:
+        return None
+
+    if first[0] == framing.COMPACT_MARKER:
+        header = first + await reader.readexactly(framing.COMPACT_HEADER.size - 1)
+        _, length = framing.COMPACT_HEADER.unpack(header)
+        body = await reader.readexactly(length)
+        stats["bytes_received"] += len(header) + length
+        return framing.decode_compact(body)
+
+    line = first + await reader.readline()
+    stats["bytes_received"] += len(line)
+    return json.loads(line)
+
+
+def answer_delay(config, rng, time_limit):
+    # "answer_delay" is {"distribution": "fixed", "seconds": s}, {"distribution": "uniform", "min": a, "max": b}
+    # or {"distribution": "exponential", "mean": m}, delays are capped just under the time limit
+    delay = config.get("answer_delay", {"distribution": "fixed", "seconds": 0})
+    distribution = delay.get("distribution", "fixed")
+    if distribution == "uniform":
+        seconds = rng.uniform(delay.get("min", 0), delay["max"])
+    elif distribution == "exponential":
+        seconds = rng.expovariate(1 / delay["mean"]) if delay["mean"] > 0 else 0
+    else:
+        seconds = delay.get("seconds", 0)
+    return min(seconds, time_limit * 0.95)
+
+
+def percentiles(values_ns):
+    # p50, p90, p99 and max in milliseconds
+    if not values_ns:
+        return "n/a"
+    ordered = sorted(values_ns)
+    picks = [ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] for fraction in (0.5, 0.9, 0.99)]
+    picks.append(ordered[-1])
+    return "p50 {:.2f} ms, p90 {:.2f} ms, p99 {:.2f} ms, max {:.2f} ms".format(*(value / 1e6 for value in picks))
+
+
+def print_report(stats, config):
+    print(f"Players: {config['players']}, finished {stats['finished']}, disconnected {stats['disconnected']} "
+          f"in {stats['elapsed_ns'] / 1e9:.2f} s")
+    print(f"Join time: {percentiles(stats['join_ns'])}")
+
+    skews = [max(arrivals) - min(arrivals) for arrivals in stats["question_arrivals"].values()]
+    print(f"Question delivery skew: {percentiles(skews)}")
+    print(f"Answer to RESULT: {percentiles(stats['result_ns'])}")
+    print(f"Received: {stats['bytes_received']} bytes ({config.get('protocol', 'json')}), "
+          f"{stats['bytes_received'] / max(1, config['players']):.0f} per player")
+
+    if stats["failures"]:
+        print("Failures: " + ", ".join(f"{reason} {count}" for reason, count in sorted(stats["failures"].items())))
+    else:
+        print("Failures: none")
+
+
+if __name__ == "__main__":
+    main()
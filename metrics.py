@@ -0,0 +1,187 @@
+import bisect
+import threading
+
+# Counters, gauges and histograms in the Prometheus text format. Each metric has its own small lock, so recording
+# never waits on a rooms players lock, and label children are looked up once and kept by the code recording them
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.lock = threading.Lock()
+        self.children = {}  # label values -> child metric recording for them
+
+    def labels(self, **labels):
+        key = tuple(str(labels[label_name]) for label_name in self.label_names)
+        with self.lock:
+            child = self.children.get(key)
+            if child is None:
+                child = self.children[key] = self.child()
+        return child
+
+    def child(self):
+        return type(self)(self.name, self.help_text)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        if not self.label_names:
+            lines += self.sample_lines("")
+        with self.lock:
+            children = sorted(self.children.items())
+        for key, child in children:
+            labels = ",".join(f'{name}="{value}"' for name, value in zip(self.label_names, key))
+            lines += child.sample_lines(labels)
+        return lines
+
+    def sample_lines(self, labels):
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text, label_names=()):
+        super().__init__(name, help_text, label_names)
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def sample_lines(self, labels):
+        return [f"{self.name}{{{labels}}} {self.value}" if labels else f"{self.name} {self.value}"]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set(self, value):
+        with self.lock:
+            self.value = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+
+    def child(self):
+        return Histogram(self.name, self.help_text, buckets=self.buckets)
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)  # found outside the lock, only the additions are guarded
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def sample_lines(self, labels):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        prefix = f"{labels}," if labels else ""
+        lines = []
+        cumulative = 0
+        for bound, count in zip(list(self.buckets) + ["+Inf"], counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{self.name}_sum{suffix} {total}")
+        lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, label_names=()):
+        return self.register(Counter(name, help_text, label_names))
+
+    def gauge(self, name, help_text, label_names=()):
+        return self.register(Gauge(name, help_text, label_names))
+
+    def histogram(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, label_names, buckets))
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics)
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+ACCEPTS = REGISTRY.counter("trivia_accepts_total", "Connections accepted")
+JOINS = REGISTRY.counter("trivia_joins_total", "Players that sent HI and joined a room")
+LOBBY_LEAVES = REGISTRY.counter("trivia_lobby_leaves_total", "Players that disconnected before their game started")
+GAMES_STARTED = REGISTRY.counter("trivia_games_started_total", "Rooms that filled up and started a game")
+ROOMS_ACTIVE = REGISTRY.gauge("trivia_rooms_active", "Games currently being played")
+
+DROPPED_MESSAGES = REGISTRY.counter("trivia_dropped_messages_total", "Messages received but not acted on", ("reason",))
+DROPPED_MALFORMED = DROPPED_MESSAGES.labels(reason="malformed")
+DROPPED_TOO_LARGE = DROPPED_MESSAGES.labels(reason="too_large")
+DROPPED_UNEXPECTED = DROPPED_MESSAGES.labels(reason="unexpected")
+DROPPED_LATE = DROPPED_MESSAGES.labels(reason="late")
+
+SEND_FAILURES = REGISTRY.counter("trivia_send_failures_total", "Players evicted because a send failed", ("reason",))
+SEND_SLOW_CONSUMER = SEND_FAILURES.labels(reason="slow_consumer")
+SEND_ERROR = SEND_FAILURES.labels(reason="error")
+
+ROUND_PHASE_SECONDS = REGISTRY.histogram("trivia_round_phase_seconds", "Time spent in each phase of a round",
+                                         ("phase",))
+PHASE_QUESTION = ROUND_PHASE_SECONDS.labels(phase="question")
+PHASE_RESULTS = ROUND_PHASE_SECONDS.labels(phase="results")
+PHASE_LEADERBOARD = ROUND_PHASE_SECONDS.labels(phase="leaderboard")
+ANSWER_LATENCY_SECONDS = REGISTRY.histogram("trivia_answer_latency_seconds",
+                                            "Question reaching a player until their answer arrived")
+BROADCAST_SECONDS = REGISTRY.histogram("trivia_broadcast_seconds", "Time to write one message to a whole room")
+
+
+def serve(port, host="127.0.0.1"):
+    # Starts the /metrics endpoint on its own thread, only reachable locally unless a host is given. http.server is
+    # imported here rather than at the top, so processes that only record metrics don't pay for it at startup
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = REGISTRY.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # scrapes would otherwise fill the servers output
+
+    http_server = ThreadingHTTPServer((host, port), MetricsHandler)
+    http_server.daemon_threads = True
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    return http_server
@@ -1,37 +1,218 @@
 # This file was created by a staff member for INFO1112 at the University of Sydney, and is not the work of the repository owner.
+# It has since been extended into a configurable mock of Ollama's /api/chat.
 
-from http.server import HTTPServer, BaseHTTPRequestHandler
 import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import questions
 
-BODY = json.dumps(
-    {
-        "model": "llama3.2",
-        "created_at": "2023-12-12T14:13:43.416799Z",
-        "message": {"role": "assistant", "content": "Hello! How are you today?"},
-        "done": True,
-        "total_duration": 5191566416,
-        "load_duration": 2154458,
-        "prompt_eval_count": 26,
-        "prompt_eval_duration": 383809000,
-        "eval_count": 298,
-        "eval_duration": 4799921000,
-    }
-).encode("utf-8")
+# Mock of Ollama's /api/chat for testing AI players offline. Questions in the prompt are answered correctly with the
+# question solvers, anything else gets the original "Hello!" reply. Replies are streamed as NDJSON unless the
+# request has "stream": false, and the latency, errors and timeouts are set in an optional config file
+# Usage: python ollama.py [--port <port>] [--concurrency <requests at once>] [--config <mock config>]
+
+DEFAULT_CONFIG = {
+    "latency": {"distribution": "fixed", "seconds": 0},  # before the first token, same shapes as loadgen's delays
+    "token_seconds": 0,  # between streamed tokens
+    "reply": "{answer}",  # what the model says about a question, "{answer}" is replaced with the correct answer
+    "error_rate": 0.0,  # fraction of requests answered with a 500
+    "timeout_rate": 0.0,  # fraction of requests that get no reply for "timeout_seconds"
+    "timeout_seconds": 60,
+    "seed": None
+}
+GREETING = "Hello! How are you today?"
+PROMPT = re.compile(r"(?:(?P<question_type>[^:]+): )?Evaluate (?P<short_question>.+?)\. No extra output")
+ROMAN_NUMERAL = re.compile(r"^[MDCLXVI]+$")
+
+
+def load_config():
+    config = dict(DEFAULT_CONFIG)
+    if "--config" in sys.argv:
+        config_index = sys.argv.index("--config") + 1
+        if config_index >= len(sys.argv):
+            sys.stderr.write("ollama.py: Configuration not provided\n")
+            sys.exit(1)
+
+        config_path = Path(sys.argv[config_index])
+        if not config_path.exists():
+            sys.stderr.write(f"ollama.py: File {config_path} does not exist\n")
+            sys.exit(1)
+        with config_path.open("r", encoding="utf-8") as file:
+            config.update(json.load(file))
+
+    config["port"] = read_int_argument("--port", 8000)
+    config["concurrency"] = read_int_argument("--concurrency", 0)  # 0 answers every request at once
+    return config
+
+
+def read_int_argument(name, default):
+    if name not in sys.argv:
+        return default
+    index = sys.argv.index(name) + 1
+    if index >= len(sys.argv) or not sys.argv[index].isdigit():
+        sys.stderr.write(f"ollama.py: {name} needs a whole number\n")
+        sys.exit(1)
+    return int(sys.argv[index])
+
+
+def latency_seconds(latency, rng):
+    # {"distribution": "fixed", "seconds": s}, {"distribution": "uniform", "min": a, "max": b}
+    # or {"distribution": "exponential", "mean": m}
+    distribution = latency.get("distribution", "fixed")
+    if distribution == "uniform":
+        return rng.uniform(latency.get("min", 0), latency["max"])
+    if distribution == "exponential":
+        return rng.expovariate(1 / latency["mean"]) if latency["mean"] > 0 else 0
+    return latency.get("seconds", 0)
+
+
+def reply_content(messages, config):
+    # The correct answer for a question prompt, worked out like the server grades it, otherwise a greeting
+    prompt = messages[-1].get("content", "") if messages else ""
+    match = PROMPT.fullmatch(prompt.strip())
+    if match is None:
+        return GREETING
+
+    short_question = match["short_question"]
+    question_type = match["question_type"] or guess_question_type(short_question)
+    answer = questions.solve_answer(question_type, short_question)
+    return config["reply"].format(answer=answer) if answer else GREETING
+
+
+def guess_question_type(short_question):
+    # Prompts without a type, both subnet types look the same so those are taken as usable address questions
+    if ROMAN_NUMERAL.match(short_question):
+        return "Roman Numerals"
+    if "/" in short_question:
+        return "Usable IP Addresses of a Subnet"
+    return "Mathematics"
+
+
+def tokens(content):
+    # Streamed a word at a time, each with the whitespace after it
+    return re.findall(r"\S+\s*|\s+", content) or [""]
 
 
 class Handler(BaseHTTPRequestHandler):
-    def _send(self):
-        if self.path == "/api/chat":
-            self.send_response(200)
-            self.send_header("Content-Type", "application/json")
-            self.end_headers()
-            self.wfile.write(BODY)
+    protocol_version = "HTTP/1.1"  # connections are kept open between requests like the real Ollama
+
+    def log_message(self, format, *args):
+        pass
 
     def do_GET(self):
-        self._send()
+        self.do_POST()
 
     def do_POST(self):
-        self._send()
+        if self.path != "/api/chat":
+            self.send_body(404, {"error": "not found"})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length)) if length else {}
+        except ValueError:
+            self.send_body(400, {"error": "request body is not JSON"})
+            return
+
+        mock = self.server.mock
+        if mock.slots is None:
+            self.reply(request, mock)
+            return
+        with mock.slots:  # requests beyond the concurrency limit wait here like a busy model
+            self.reply(request, mock)
+
+    def reply(self, request, mock):
+        config = mock.config
+        with mock.lock:
+            roll = mock.rng.random()
+            delay = latency_seconds(config["latency"], mock.rng)
+        if roll < config["error_rate"]:
+            self.send_body(500, {"error": "injected error"})
+            return
+        if roll < config["error_rate"] + config["timeout_rate"]:
+            time.sleep(config["timeout_seconds"])
+            self.close_connection = True
+            return
+
+        model = request.get("model", "llama3.2")
+        messages = request.get("messages", [])
+        if not messages:  # only loads the model
+            self.send_body(200, {"model": model, "message": {"role": "assistant", "content": ""},
+                                 "done_reason": "load", "done": True})
+            return
+
+        time.sleep(delay)
+        content = reply_content(messages, config)
+        if not request.get("stream", True):
+            time.sleep(config["token_seconds"] * len(tokens(content)))
+            self.send_body(200, {"model": model, "message": {"role": "assistant", "content": content},
+                                 "done": True})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for i, token in enumerate(tokens(content)):
+                if i:
+                    time.sleep(config["token_seconds"])
+                self.write_chunk({"model": model, "message": {"role": "assistant", "content": token}, "done": False})
+            self.write_chunk({"model": model, "message": {"role": "assistant", "content": ""}, "done": True})
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True  # the client hung up, usually once it had its answer
+
+    def write_chunk(self, message):
+        line = json.dumps(message).encode("utf-8") + b"\n"
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+
+    def send_body(self, status, message):
+        body = json.dumps(message).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class Mock:
+
+    def __init__(self, config):
+        self.config = {**DEFAULT_CONFIG, **config}
+        self.rng = random.Random(self.config["seed"])
+        self.lock = threading.Lock()  # the rng is shared by every request thread
+        concurrency = self.config.get("concurrency", 0)
+        self.slots = threading.Semaphore(concurrency) if concurrency else None
+
+
+def create_mock(config):
+    http_server = MockServer((config.get("host", ""), config.get("port", 8000)), Handler)
+    http_server.mock = Mock(config)
+    return http_server
+
+
+def main():
+    config = load_config()
+    try:
+        http_server = create_mock(config)
+    except OSError:
+        sys.stderr.write(f"ollama.py: Binding to port {config['port']} was unsuccessful\n")
+        sys.exit(1)
+    try:
+        http_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
 
 
-HTTPServer(("", 8000), Handler).serve_forever()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import http.client
+import json
+import socket
+import threading
+import time
+
+# Pooled keep-alive client for Ollama's /api/chat. Connections are reused between questions, so only the first
+# question pays for connection setup, and every request runs against a deadline: each socket read waits only for
+# the time left, and a request still running at the deadline is abandoned by closing its connection (Ollama stops
+# generating once its client disconnects). No signals are used, so any thread can ask
+
+MAX_IDLE_CONNECTIONS = 4  # idle connections kept per client, more are closed once their request finishes
+READ_SIZE = 65536
+
+CLIENTS = {}  # (host, port) -> OllamaClient, shared by everything asking the same server
+CLIENTS_LOCK = threading.Lock()
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class OllamaClient:
+
+    def __init__(self, host, port, max_idle=MAX_IDLE_CONNECTIONS):
+        self.host = host
+        self.port = port
+        self.max_idle = max_idle
+        self.idle = []  # open connections waiting for the next request
+        self.lock = threading.Lock()
+
+    def chat(self, model, content, deadline, keep_alive=None, options=None, stream=False, extract=None):
+        # Reply text for one user message, raises DeadlineExceeded once time.monotonic() passes deadline. With
+        # extract, the answer it finds in the reply is returned instead, and with stream the reply is read as it is
+        # generated and abandoned as soon as extract finds one
+        payload = {"model": model, "messages": [{"role": "user", "content": content}], "stream": stream}
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive  # how long Ollama keeps the model loaded after this request
+        if options:
+            payload["options"] = options
+
+        if stream:
+            return self.post("/api/chat", payload, deadline, lambda *args: read_stream(*args, extract))
+        text = json.loads(self.post("/api/chat", payload, deadline))["message"]["content"]
+        return final_answer(text, extract)
+
+    def load_model(self, model, keep_alive=None, timeout=60):
+        # A chat without messages only loads the model, done ahead of the first question to skip a cold load
+        payload = {"model": model, "messages": []}
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+        self.post("/api/chat", payload, time.monotonic() + timeout)
+
+    def post(self, path, payload, deadline, read=None):
+        # read(sock, response, deadline) -> (result, whole body read), by default the body is read whole
+        body = json.dumps(payload).encode("utf-8")
+        headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
+        for attempt in range(2):
+            connection, reused = self.acquire(deadline)
+            sock = connection.sock  # kept, the connection lets go of it when the server will close it after the reply
+            response = None
+            try:
+                set_deadline(sock, deadline)
+                connection.request("POST", path, body, headers)
+                response = connection.getresponse()
+                data, complete = (read or read_body)(sock, response, deadline)
+            except (socket.timeout, DeadlineExceeded):
+                connection.close()  # abandons the request, the server sees the disconnect
+                raise DeadlineExceeded(f"no reply from {self.host}:{self.port} before the deadline")
+            except (http.client.HTTPException, ConnectionError):
+                connection.close()
+                if reused and attempt == 0 and response is None:
+                    continue  # the server closed an idle keep-alive connection, retried once on a new one
+                raise
+
+            if response.will_close or not complete:
+                response.close()  # the response holds the socket open too
+                connection.close()  # a body left unread can't be skipped, the connection is closed instead
+            else:
+                self.release(connection)
+            if response.status != 200:
+                raise http.client.HTTPException(f"{self.host}:{self.port}{path} returned {response.status}")
+            return data
+
+    def acquire(self, deadline):
+        with self.lock:
+            if self.idle:
+                return self.idle.pop(), True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded("deadline passed before connecting")
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=remaining)
+        connection.connect()
+        connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return connection, False
+
+    def release(self, connection):
+        with self.lock:
+            if len(self.idle) < self.max_idle:
+                self.idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection in idle:
+            connection.close()
+
+
+def set_deadline(sock, deadline):
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded("deadline passed")
+    sock.settimeout(remaining)
+
+
+def read_body(sock, response, deadline):
+    # Reads in pieces so the deadline covers the whole body, not just the wait for each piece
+    chunks = []
+    while True:
+        set_deadline(sock, deadline)
+        chunk = response.read1(READ_SIZE)
+        if not chunk:
+            response.close()  # marks the response finished, the connection is free for the next request
+            return b"".join(chunks), True
+        chunks.append(chunk)
+
+
+def read_stream(sock, response, deadline, extract):
+    # Ollama streams one JSON object per line, each with the next piece of the reply
+    pending = b""
+    parts = []
+    while True:
+        set_deadline(sock, deadline)
+        chunk = response.read1(READ_SIZE)
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop() if chunk else b""  # the last line may be unfinished until the body ends
+        for line in lines:
+            if line.strip():
+                parts.append(json.loads(line).get("message", {}).get("content", ""))
+
+        if not chunk:
+            response.close()
+            return final_answer("".join(parts), extract), True
+        if extract is not None:
+            answer = extract("".join(parts), False)
+            if answer is not None:
+                return answer, False  # closing the connection stops the rest of the generation
+
+
+def final_answer(text, extract):
+    # The answer in a complete reply, or the whole reply when extract finds none
+    if extract is None:
+        return text
+    answer = extract(text, True)
+    return text if answer is None else answer
+
+
+def get_client(ollama_config):
+    key = (ollama_config["ollama_host"], ollama_config["ollama_port"])
+    with CLIENTS_LOCK:
+        client = CLIENTS.get(key)
+        if client is None:
+            client = CLIENTS[key] = OllamaClient(*key)
+    return client
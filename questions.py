@@ -1,21 +1,25 @@
+import importlib
 import random
+import threading
+from collections import deque
+import solvers
 
 
-def generate_mathematics_question() -> str:
+def generate_mathematics_question(rng=random) -> str:
     operators = ["+", "-"]
-    number_of_terms = random.randint(2, 5)
-    expression = str(random.randint(1, 100))
+    number_of_terms = rng.randint(2, 5)
+    expression = str(rng.randint(1, 100))
 
     for _ in range(number_of_terms - 1):
-        op = random.choice(operators)
-        num = random.randint(1, 100)
+        op = rng.choice(operators)
+        num = rng.randint(1, 100)
         expression += f" {op} {num}"
 
     return expression
 
     
-def generate_roman_numerals_question() -> str:
-    number = random.randint(1, 3999)
+def generate_roman_numerals_question(rng=random) -> str:
+    number = rng.randint(1, 3999)
     vals = [
         (1000, "M"), (900, "CM"), (500, "D"), (400, "CD"),
         (100, "C"), (90, "XC"), (50, "L"), (40, "XL"),
@@ -29,11 +33,129 @@ def generate_roman_numerals_question() -> str:
     return roman
 
     
-def generate_usable_addresses_question() -> str:
-    prefix = random.randint(0, 32)
-    ip = ".".join(str(random.randint(0, 255)) for _ in range(4))
+def generate_usable_addresses_question(rng=random) -> str:
+    prefix = rng.randint(0, 32)
+    ip = ".".join(str(rng.randint(0, 255)) for _ in range(4))
     return f"{ip}/{prefix}"
 
     
-def generate_network_broadcast_question() -> str:
-    return generate_usable_addresses_question()  # both functions have same functionality
+def generate_network_broadcast_question(rng=random) -> str:
+    return generate_usable_addresses_question(rng)  # both functions have same functionality
+
+
+class QuestionType:
+    # Everything needed for one kind of question, looked up by name in QUESTION_TYPES
+
+    __slots__ = ("name", "generator", "solver", "normalizer", "extractor")
+
+    def __init__(self, name, generator, solver, normalizer=solvers.normalize_answer, extractor=solvers.extract_number):
+        self.name = name
+        self.generator = generator  # rng -> short question
+        self.solver = solver  # short question -> correct answer, "" when it can't be solved
+        self.normalizer = normalizer  # answer -> form compared when grading
+        self.extractor = extractor  # (model reply so far, reply complete) -> answer in it, None until there is one
+
+
+QUESTION_TYPES = {}  # shared by server and client, so both solve every type the same way
+
+
+def register_question_type(name, generator, solver, normalizer=solvers.normalize_answer,
+                           extractor=solvers.extract_number):
+    QUESTION_TYPES[name] = QuestionType(name, generator, solver, normalizer, extractor)
+
+
+def load_question_plugins(module_names):
+    # Plugin modules add their own types by calling register_question_type when imported
+    for module_name in module_names:
+        importlib.import_module(module_name)
+
+
+def solve_answer(question_type, short_question):
+    entry = QUESTION_TYPES.get(question_type)
+    if entry is None or short_question is None:
+        return ""
+    return entry.solver(short_question)
+
+
+def extract_answer(question_type, text, done):
+    entry = QUESTION_TYPES.get(question_type)
+    return entry.extractor(text, done) if entry else None
+
+
+register_question_type("Mathematics", generate_mathematics_question, solvers.solve_mathematics)
+register_question_type("Roman Numerals", generate_roman_numerals_question, solvers.solve_roman_numerals)
+register_question_type("Usable IP Addresses of a Subnet", generate_usable_addresses_question,
+                       solvers.solve_usable_addresses)
+register_question_type("Network and Broadcast Address of a Subnet", generate_network_broadcast_question,
+                       solvers.solve_network_broadcast, extractor=solvers.extract_address_pair)
+
+
+class Question:
+    # A generated question with its answer worked out once, grading each player is then a set lookup
+
+    __slots__ = ("question_type", "short_question", "answer", "accepted", "normalizer")
+
+    def __init__(self, question_type, short_question):
+        entry = QUESTION_TYPES.get(question_type)
+        self.question_type = question_type
+        self.short_question = short_question
+        self.answer = solve_answer(question_type, short_question)
+        self.normalizer = entry.normalizer if entry else solvers.normalize_answer
+        self.accepted = {self.normalizer(self.answer)} if self.answer else set()
+
+    def is_correct(self, player_response):
+        return self.normalizer(player_response) in self.accepted
+
+
+def generate_question(question_type, rng=random):
+    entry = QUESTION_TYPES.get(question_type)
+    return Question(question_type, entry.generator(rng) if entry else None)
+
+
+class QuestionPool:
+    # Pre-generates and solves questions per type on a background thread, so handing one out is just a deque pop.
+    # Each type has its own Random seeded from the game seed, so the order never depends on thread timing.
+
+    def __init__(self, question_types, seed=None, batch_size=16):
+        self.seed = random.randrange(2 ** 32) if seed is None else seed
+        self.batch_size = batch_size
+        self.pools = {question_type: deque() for question_type in question_types if question_type in QUESTION_TYPES}
+        self.rngs = {question_type: random.Random(f"{self.seed}:{question_type}") for question_type in self.pools}
+        self.lock = threading.Lock()
+        self.refill_needed = threading.Event()
+        self.closed = False
+
+        self.refill_needed.set()  # fill every type straight away, while READY and the first interval play out
+        threading.Thread(target=self.refill_loop, daemon=True).start()
+
+    def next_question(self, question_type):
+        if question_type not in self.pools:
+            return Question(question_type, None)  # no generator for this type
+
+        with self.lock:
+            pool = self.pools[question_type]
+            if not pool:  # background worker fell behind, generate on the spot from the same sequence
+                self.generate(question_type, 1)
+            short_question = pool.popleft()
+            if len(pool) <= self.batch_size // 2:
+                self.refill_needed.set()
+        return short_question
+
+    def refill_loop(self):
+        while True:
+            self.refill_needed.wait()
+            if self.closed:
+                return
+            self.refill_needed.clear()
+
+            for question_type, pool in self.pools.items():
+                with self.lock:  # one type at a time, so next_question never waits on a whole refill
+                    self.generate(question_type, self.batch_size - len(pool))
+
+    def generate(self, question_type, count):
+        rng = self.rngs[question_type]
+        self.pools[question_type].extend(generate_question(question_type, rng) for _ in range(count))
+
+    def close(self):
+        self.closed = True
+        self.refill_needed.set()
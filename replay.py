@@ -0,0 +1,121 @@
+import sys
+import time
+from pathlib import Path
+import event_log
+import questions
+import server
+from leaderboard import Leaderboard
+
+# Re-runs every game in an event log: regenerates its questions from the seed, grades every answer again with
+# evaluate_answer and the scoring rules, rebuilds the leaderboard and checks each step against what was logged
+# Usage: python replay.py --log <event log> [--room <room id>]
+
+
+def main():
+    path = load_log_path()
+    room_filter = sys.argv[sys.argv.index("--room") + 1] if "--room" in sys.argv[:-1] else None
+
+    mismatched = 0
+    for game in read_games(event_log.read_events(path)):
+        if room_filter is not None and game["room"] != room_filter:
+            continue
+        start_ns = time.perf_counter_ns()
+        mismatches = replay_game(game)
+        elapsed_ms = (time.perf_counter_ns() - start_ns) / 1e6
+
+        answer_count = sum(len(answers) for _, answers in game["questions"])
+        status = "OK" if not mismatches else f"{len(mismatches)} mismatches"
+        print(f"Room {game['room']}: {len(game['questions'])} questions, {answer_count} answers replayed in "
+              f"{elapsed_ms:.2f} ms, {status}")
+        for mismatch in mismatches:
+            print(f"  {mismatch}")
+        mismatched += bool(mismatches)
+
+    sys.exit(1 if mismatched else 0)
+
+
+def load_log_path():
+    if "--log" not in sys.argv or sys.argv.index("--log") + 1 >= len(sys.argv):
+        sys.stderr.write("replay.py: Event log not provided\n")
+        sys.exit(1)
+
+    path = Path(sys.argv[sys.argv.index("--log") + 1])
+    if not path.exists():
+        sys.stderr.write(f"replay.py: File {path} does not exist\n")
+        sys.exit(1)
+    return path
+
+
+def read_games(events):
+    # Groups events into games, a named room can be played again once its previous game has finished
+    playing = {}  # room id -> game still in progress
+    for event in events:
+        kind = event["event"]
+        if kind == "game_start":
+            playing[event["room"]] = {"room": event["room"], "start": event, "questions": [], "finished": None}
+        game = playing.get(event.get("room"))
+        if game is None:
+            continue  # lobby joins and leaves, the players that stayed are listed in game_start
+
+        if kind == "question":
+            game["questions"].append((event, []))
+        elif kind == "answer" and game["questions"]:
+            game["questions"][-1][1].append(event)
+        elif kind == "finished":
+            game["finished"] = event
+            yield playing.pop(event["room"])
+
+    yield from playing.values()  # logs cut off mid game are replayed as far as they go
+
+
+def replay_game(game):
+    start = game["start"]
+    config = {"question_seconds": start["question_seconds"], "scoring": start["scoring"],
+              "speed_points": start["speed_points"]}
+    mismatches = []
+
+    standings = Leaderboard()
+    players = {}
+    for number, username in start["players"]:
+        players[number] = {"username": username, "score": 0}
+        standings.add(players[number], number)
+
+    pool = questions.QuestionPool(start["question_types"], start["seed"])
+    try:
+        for question_event, answers in game["questions"]:
+            index = question_event["index"]
+            question_type = question_event["question_type"]
+            short_question = question_event["short_question"]
+
+            if pool.next_question(question_type).short_question != short_question:
+                mismatches.append(f"question {index + 1}: {short_question!r} isn't what seed {start['seed']} gives")
+            correct_answer, _ = server.evaluate_answer(question_type, short_question, None)
+            if correct_answer != question_event["answer"]:
+                mismatches.append(f"question {index + 1}: answer {question_event['answer']!r}, "
+                                  f"evaluate_answer gives {correct_answer!r}")
+
+            question = questions.Question(question_type, short_question)
+            for answer in answers:
+                player = players[answer["player"]]
+                is_correct = question.is_correct(answer["answer"])
+                points = server.award_points(answer["latency_ns"], config) if is_correct else 0
+                player["score"] += points
+                standings.update(player)
+
+                if (is_correct, points, player["score"]) != (answer["correct"], answer["points"], answer["score"]):
+                    mismatches.append(f"question {index + 1}, {player['username']}: logged correct "
+                                      f"{answer['correct']} points {answer['points']} score {answer['score']}, "
+                                      f"replay gives {is_correct} {points} {player['score']}")
+    finally:
+        pool.close()
+
+    if game["finished"] is not None:
+        replayed = [[rank, player["leaderboard_key"][1], player["username"], score]
+                    for rank, player, score in standings.ranked()]
+        if replayed != game["finished"]["standings"]:
+            mismatches.append(f"final standings {game['finished']['standings']}, replay gives {replayed}")
+    return mismatches
+
+
+if __name__ == "__main__":
+    main()
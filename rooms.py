@@ -0,0 +1,67 @@
+import itertools
+import threading
+from leaderboard import Leaderboard
+
+
+class Room:
+    # One game, its players and the lock guarding them, runs independently of every other room
+
+    def __init__(self, room_id, capacity):
+        self.room_id = room_id
+        self.capacity = capacity
+        self.players = []
+        self.lock = threading.Lock()  # prevents players form accessing variables simultaneously in leaderboard
+        self.started = False
+        self.question_pool = None  # created when the game starts, holds the seed needed to replay it
+        self.leaderboard = Leaderboard()  # kept up to date as players join and score
+        self.game = {}  # engine specific round state, e.g. the asyncio engines answer events
+
+    def is_full(self):
+        return len(self.players) >= self.capacity
+
+
+class Lobby:
+    # Hands joining players a room, either the one named in their HI or the next auto matched room filling up
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.filling = {}  # room id -> named room still waiting for players, started rooms are no longer tracked here
+        self.auto_ids = itertools.count(1)
+        self.auto_room = None  # auto matched room filling up, kept apart so a client naming "auto-1" can't join it
+        self.lock = threading.Lock()
+
+    def join(self, player, room_id=None):
+        # Adds the player to a room, returns the room and whether this player filled it (so its game should start)
+        with self.lock:
+            room = self.find_room(room_id)
+            with room.lock:
+                room.players.append(player)
+                room.leaderboard.add(player)
+                if not room.is_full():
+                    return room, False
+                room.started = True
+
+            if room is self.auto_room:
+                self.auto_room = None
+            else:
+                del self.filling[room.room_id]  # the next player asking for this id gets a fresh room
+            return room, True
+
+    def leave(self, player, room):
+        # Player disconnected before their game started, frees up their spot
+        with self.lock, room.lock:
+            if not room.started and player in room.players:
+                room.players.remove(player)
+                room.leaderboard.remove(player)
+
+    def find_room(self, room_id):
+        if room_id is None:
+            if self.auto_room is None:
+                self.auto_room = Room(f"auto-{next(self.auto_ids)}", self.capacity)
+            return self.auto_room
+
+        room = self.filling.get(room_id)
+        if room is None:
+            room = Room(room_id, self.capacity)
+            self.filling[room_id] = room
+        return room
@@ -1,58 +1,109 @@
+import atexit
 import json
+import selectors
+import signal
 import socket
 import sys
 import time
 import threading
 from pathlib import Path
+import event_log
+import framing
+import handshake
+import leaderboard
+import metrics
 import questions
+import rooms
 
-players = []
-players_threading_lock = threading.Lock()  # prevents players form accessing variables simultaneously in leaderboard
+MAX_OUTBOX_BYTES = 256 * 1024  # queued bytes a player may fall behind by before being evicted
+SLOW_CONSUMER_SECONDS = 2.0  # how long a broadcast waits on a full socket before evicting that player
+# Least time from the start of one phase to the next, overridden by "phase_seconds" in the config. Small gaps keep
+# each message type apart on the wire for clients that only read one line per recv
+PHASE_SECONDS = {"result": 0.0, "leaderboard": 0.05, "question": 0.05, "finished": 0.05}
+SPEED_POINTS = 1000  # most a correct answer is worth with "scoring": "speed", an answer at the time limit gets half
+STALE_READS = 16  # most reads taken from a socket between rounds, so a flooding client can't hold up the game
 
 
 def main():
     config = load_config()
-    port = config["port"]
-    max_players = config["players"]
+    engine = load_engine()
+    worker_count = load_workers()
 
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # allows immediate server reuse (os has a wait time)
+    if worker_count > 1:
+        import workers  # only needed when sharding games across processes
+        workers.main(config, engine, worker_count)
+        return
+
+    start_metrics(config)
+    start_event_log(config)
+    atexit.register(event_log.close_log)  # writes out the events still queued when the server stops
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))  # so atexit runs when terminated too
+
+    if engine == "asyncio":
+        import async_server  # imported lazily so the threaded engine doesn't pay for asyncio start up
+        async_server.main(config)
+        return
+
+    lobby = rooms.Lobby(config["players"])  # every room fills up to the configured number of players
+    loop = create_handshake_loop(lobby, config)
+
+    with bind_listener(config["port"]) as sock:
+        # Keeps accepting while games run, each full room plays on its own thread
+        loop.add_listener(sock)
         try:
-            sock.bind(("0.0.0.0", port))
-        except Exception:
-            sys.stderr.write(f"server.py: Binding to port {port} was unsuccessful\n")
-            sys.exit(1)
-
-        sock.listen()
-        all_players_connected = False  # Flag checks when all players connected
-
-        while True:
-            connection, address = sock.accept()
-            join_flag = threading.Event()  # Informs when client handling is complete in thread
-            threading.Thread(target=handle_add_client, args=(connection, join_flag), daemon=True).start()
-
-            if not join_flag.wait(timeout=3):
-                continue  # Client didn't connect quick enough for some reason, skip them
-
-            with players_threading_lock:  # Ensures threads enter block one at a time
-                if len(players) >= max_players:  # Enough players joined
-                    all_players_connected = True
-
-            if all_players_connected:
-                time.sleep(0.3)  # wait a bit before re-checking if clients disconnected
-                with players_threading_lock:
-                    for player in players:
-                        try:
-                            player["connection"].send(b"")  # Check if player is currently connected
-                        except Exception:
-                            players.remove(player)
-                    if len(players) >= max_players:  # Recheck if enough players connected, then continue
-                        break
-                    else:  # Else wait for more players
-                        all_players_connected = False
-
-        print("All players connected. Ready to start the game!")
-        main_game_handler(config)
+            loop.run()
+        except KeyboardInterrupt:
+            pass
+
+
+def bind_listener(port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # allows immediate server reuse (os has a wait time)
+    try:
+        sock.bind(("0.0.0.0", port))
+    except Exception:
+        sys.stderr.write(f"server.py: Binding to port {port} was unsuccessful\n")
+        sys.exit(1)
+
+    sock.listen(1024)  # room for a burst of clients connecting at once
+    return sock
+
+
+def start_metrics(config, offset=0):
+    # Optional "metrics_port" serves /metrics on its own port, worker processes use the ports after it
+    port = config.get("metrics_port")
+    if port is None:
+        return
+    try:
+        metrics.serve(port + offset)
+    except OSError:
+        sys.stderr.write(f"server.py: Binding to metrics port {port + offset} was unsuccessful\n")
+        sys.exit(1)
+
+
+def start_event_log(config, suffix=""):
+    # Optional "event_log" path every game is appended to, worker processes each write their own file
+    path = config.get("event_log")
+    if path is None:
+        return
+    try:
+        event_log.open_log(f"{path}{suffix}")
+    except OSError:
+        sys.stderr.write(f"server.py: Event log {path}{suffix} could not be opened\n")
+        sys.exit(1)
+
+
+def run_room(room, config):
+    print(f"All players connected in room {room.room_id}. Ready to start the game!")
+    metrics.GAMES_STARTED.inc()
+    metrics.ROOMS_ACTIVE.inc()
+    create_question_pool(room, config)
+    record_game_start(room, config)
+    try:
+        main_game_handler(room, config)
+    finally:
+        room.question_pool.close()
+        metrics.ROOMS_ACTIVE.dec()
 
 
 def load_config():
@@ -72,302 +123,597 @@ def load_config():
         sys.exit(1)
 
     with config_file_path.open("r", encoding="utf-8") as file:
-        return json.load(file)  # load file into json
+        config = json.load(file)  # load file into json
 
+    questions.load_question_plugins(config.get("question_plugins", []))  # extra question types added by modules
+    return config
 
-def handle_add_client(connection, joined_flag):
-    # Function gets hi messages from client and adds to players list
-    try:
-        while True:
-            data = connection.recv(1024)
-            if not data:
-                break
-            message = json.loads(data.decode().strip())
-            if message.get("message_type") == "HI":
-                username = message.get("username")
-                with players_threading_lock:
-                    players.append({"connection": connection, "username": username, "score": 0})
-                joined_flag.set()  # Flag ensures main gives thread enough time for adding player
-                break
-    except Exception:
-        pass
+
+def load_engine():
+    # Optional --engine argument picks between the threaded and asyncio servers
+    if "--engine" not in sys.argv:
+        return "threads"
+
+    engine_index = sys.argv.index("--engine") + 1
+    if engine_index >= len(sys.argv) or sys.argv[engine_index] not in ("threads", "asyncio"):
+        sys.stderr.write("server.py: Engine must be one of threads, asyncio\n")
+        sys.exit(1)
+
+    return sys.argv[engine_index]
+
+
+def load_workers():
+    # Optional --workers argument, more than one shards games across that many processes
+    if "--workers" not in sys.argv:
+        return 1
+
+    workers_index = sys.argv.index("--workers") + 1
+    if workers_index >= len(sys.argv) or not sys.argv[workers_index].isdigit() or int(sys.argv[workers_index]) < 1:
+        sys.stderr.write("server.py: Workers must be a positive number\n")
+        sys.exit(1)
+
+    return int(sys.argv[workers_index])
+
+
+def create_handshake_loop(lobby, config):
+    # New connections wait in one selector until they send HI, then join a room, starting its game once full
+    def on_hello(connection, buffer, message, received):
+        add_player(loop, connection, buffer, message, lobby, config)
+
+    loop = handshake.HandshakeLoop(on_hello)
+    return loop
+
+
+def add_player(loop, connection, buffer, message, lobby, config):
+    # buffer is kept with the player so anything sent right after HI isn't lost
+    player = {"connection": connection, "buffer": buffer, "outbox": bytearray(),
+              "username": message.get("username"), "score": 0, "connected": True,
+              "leaderboard_delta": read_leaderboard_delta(message), "protocol": read_protocol(message)}
+    room, full = lobby.join(player, read_room_id(message))
+    metrics.JOINS.inc()
+    record_join(room, player)
+    if not full:
+        loop.watch(connection, buffer, lambda: leave_lobby(player, room, lobby))
+        return
+
+    for waiting_player in room.players:  # the game thread reads their sockets from now on
+        loop.forget(waiting_player["connection"])
+    threading.Thread(target=run_room, args=(room, config), daemon=True).start()
+
+
+def leave_lobby(player, room, lobby):
+    # Player disconnected while waiting for their room to fill up
+    player["connected"] = False
+    lobby.leave(player, room)
+    player["connection"].close()
+    metrics.LOBBY_LEAVES.inc()
+    event_log.record("leave", room=room.room_id, player=player["leaderboard_key"][1])
+
+
+def read_room_id(message):
+    # HI may name a room to join, without one the player is matched into the next room filling up
+    room_id = message.get("room")
+    return None if room_id is None else str(room_id)
+
+
+def read_leaderboard_delta(message):
+    # Clients sending "leaderboard": "delta" in HI rebuild the standings themselves from changed scores
+    return message.get("leaderboard") == "delta"
+
+
+def read_protocol(message):
+    # Clients sending "protocol": "compact" in HI get compact binary frames, anything else keeps JSON lines
+    return "compact" if message.get("protocol") == "compact" else "json"
+
+
+def send_json_all_players(room, message):
+    encoded = {}  # serialised once per protocol, the same bytes go to every player using it
+    with room.lock:
+        targets = [player for player in room.players if player["connected"]]
+
+    start_ns = time.monotonic_ns()
+    for player in targets:
+        queue_payload(player, framing.encode_for(player["protocol"], message, encoded))
+
+    stats = flush_players(targets)
+    metrics.BROADCAST_SECONDS.observe((time.monotonic_ns() - start_ns) / 1e9)
+    return stats
+
+
+def queue_payload(player, payload):
+    # Adds bytes to a players outbox, a player already too far behind is evicted instead (backpressure). Only what is
+    # still queued counts, one message larger than the cap (FINISHED in a big room) still goes to a player keeping up
+    if not player["connected"]:
+        return
+    if len(player["outbox"]) > MAX_OUTBOX_BYTES:
+        evict_player(player, metrics.SEND_SLOW_CONSUMER)
+        return
+    player["outbox"] += payload
 
 
-def send_json(connection, message):
+def flush_players(targets):
+    # Writes every queued outbox without letting one full socket hold up the others
+    start_ns = time.monotonic_ns()
+    deadline = time.monotonic() + SLOW_CONSUMER_SECONDS
+
+    # First pass hands every player their bytes straight away, most sockets take it all in one send
+    waiting = [player for player in targets if not write_outbox(player) and player["connected"]]
+
+    if waiting:
+        selector = selectors.DefaultSelector()
+        for player in waiting:
+            selector.register(player["connection"], selectors.EVENT_WRITE, player)
+
+        try:
+            while selector.get_map():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                for key, _ in selector.select(timeout=remaining):
+                    if write_outbox(key.data) or not key.data["connected"]:
+                        selector.unregister(key.fileobj)
+
+            for key in list(selector.get_map().values()):  # still not drained, slow consumer
+                evict_player(key.data, metrics.SEND_SLOW_CONSUMER)
+        finally:
+            selector.close()
+
+    return delivery_stats(targets, start_ns)
+
+
+def write_outbox(player):
+    # Sends as much of the outbox as the socket accepts, returns True once it is empty
+    if not player["connected"]:
+        return False
     try:
-        encoded = json.dumps(message).encode("utf-8") + b"\n"
-        connection.sendall(encoded)
-    except (BrokenPipeError, ConnectionResetError, OSError):
+        sent = player["connection"].send(player["outbox"])
+        del player["outbox"][:sent]
+    except BlockingIOError:
+        return False
+    except OSError:
+        evict_player(player, metrics.SEND_ERROR)
+        return False
+
+    if player["outbox"]:
+        return False
+    player["delivered_ns"] = time.monotonic_ns()
+    return True
+
+
+def evict_player(player, failure):
+    # Player stops receiving messages and answering, but keeps their place in the standings
+    if player["connected"]:
+        failure.inc()
+    player["connected"] = False
+    player["outbox"].clear()
+    try:
+        player["connection"].close()
+    except OSError:
         pass
 
 
-def send_json_all_players(message):
-    for player in players:
-        send_json(player["connection"], message)
+def report_delivery(room, index, stats):
+    # Question start time fairness, how far apart the first and last player received the question
+    evicted = f", evicted {', '.join(stats['evicted'])}" if stats["evicted"] else ""
+    print(f"Room {room.room_id}: question {index + 1} delivered to {len(stats['delivery_ns'])} players, "
+          f"skew {stats['skew_ns'] / 1e6:.2f} ms{evicted}")
+
 
+def delivery_stats(targets, start_ns):
+    # Per player time from broadcast start until their bytes were handed to the kernel, and the spread between them
+    delivery_ns = {p["username"]: p["delivered_ns"] - start_ns for p in targets
+                   if p["connected"] and p.get("delivered_ns", 0) >= start_ns}
+    skew_ns = max(delivery_ns.values()) - min(delivery_ns.values()) if delivery_ns else 0
+    evicted = [p["username"] for p in targets if not p["connected"]]
+    return {"delivery_ns": delivery_ns, "skew_ns": skew_ns, "evicted": evicted}
 
-def main_game_handler(config):
-    ready_info = config["ready_info"].format(**config)
-    send_json_all_players({"message_type": "READY", "info": ready_info})
+
+def main_game_handler(room, config):
+    phases = load_phase_seconds(config)
+    send_json_all_players(room, build_ready_message(config))
 
     time.sleep(config["question_interval_seconds"])
 
     question_types = config["question_types"]
-    question_formats = config["question_formats"]
-    question_word = config["question_word"]
     time_limit = config["question_seconds"]
 
-    # Each question handled in loop
+    # Each question handled in loop, every phase starts as soon as the one before it is done
     for i, question_type in enumerate(question_types):
-        short_question = generate_short_question(question_type)
-        trivia_question = f"{question_word} {i + 1} ({question_type}):\n{question_formats[question_type].format(short_question)}"
-
-        question_message = {
-            "message_type": "QUESTION",
-            "question_type": question_type,
-            "trivia_question": trivia_question,
-            "short_question": short_question,
-            "time_limit": time_limit
-        }
+        question = room.question_pool.next_question(question_type)
+        question_message = build_question_message(config, i, question)
 
-        send_json_all_players(question_message)
+        discard_stale_answers(room)  # anything still buffered was meant for an earlier question
+        question_start = time.monotonic()
+        broadcast_ns = time.monotonic_ns()
+        report_delivery(room, i, send_json_all_players(room, question_message))
+        mark_question_sent(room, broadcast_ns)
+        record_question(room, i, question)
 
-        player_responses = collect_player_responses(short_question, config, time_limit)
+        player_responses = collect_player_responses(room, time_limit)  # returns once everyone answered
+        metrics.PHASE_QUESTION.observe(time.monotonic() - question_start)
 
-        time.sleep(time_limit / 100)  # wait a tiny bit of time more for receiving responses
-        send_results(player_responses, short_question, question_type, config)
-        time.sleep(time_limit / 100)  # let all results send before sending leaderboard
+        phase_start = wait_for_phase(time.monotonic(), phases["result"])
+        send_results(room, player_responses, question, config)  # returns once results are written
+        metrics.PHASE_RESULTS.observe(time.monotonic() - phase_start)
 
         if i < len(question_types) - 1:  # Don't send leaderboard on final question
-            send_leaderboard(config)
-            time.sleep(time_limit / 5)  # allows time for leaderboard calculations and sending
-
-    send_finished(config)
-
-
-def generate_short_question(question_type):
-    # Calls questions.py for relevant question generation
-    if question_type == "Mathematics":
-        return questions.generate_mathematics_question()
-    elif question_type == "Roman Numerals":
-        return questions.generate_roman_numerals_question()
-    elif question_type == "Usable IP Addresses of a Subnet":
-        return questions.generate_usable_addresses_question()
-    elif question_type == "Network and Broadcast Address of a Subnet":
-        return questions.generate_network_broadcast_question()
-    else:
-        return
+            phase_start = wait_for_phase(phase_start, phases["leaderboard"])
+            send_leaderboard(room, config, i)
+            metrics.PHASE_LEADERBOARD.observe(time.monotonic() - phase_start)
+            wait_for_phase(phase_start, phases["question"])
+        else:
+            wait_for_phase(phase_start, phases["finished"])
 
+    send_finished(room, config)
 
-def collect_player_responses(_, _2, time_limit):
-    answers = {}
-    deadline = time.time() + time_limit + 0.5  # provides slightly more than time limit in case response still arriving
 
-    while time.time() < deadline:
-        with players_threading_lock:  # lock prevents threads racing to change variables
-            for player in players:
-                connection = player["connection"]
-                connection.settimeout(0.1)
-                try:
-                    data = connection.recv(1024)
-                    if not data:
-                        continue
-                    message = json.loads(data.decode().strip())
-                    if message.get("message_type") == "ANSWER":
-                        answers[player["username"]] = message["answer"]
-                except socket.timeout:
-                    continue
-                except Exception:
-                    continue
+def record_join(room, player):
+    event_log.record("join", room=room.room_id, player=player["leaderboard_key"][1], username=player["username"])
 
-        if len(answers) == len(players):  # enough responses received
-            break
 
-    return answers
+def record_game_start(room, config):
+    # Everything replay.py needs to regenerate the questions and grade the answers again
+    event_log.record("game_start", room=room.room_id, seed=room.question_pool.seed,
+                     question_types=config["question_types"], question_seconds=config["question_seconds"],
+                     scoring=config.get("scoring", "flat"), speed_points=config.get("speed_points", SPEED_POINTS),
+                     players=[[player["leaderboard_key"][1], player["username"]] for player in room.players])
 
 
-def evaluate_answer(question_type, short_question, player_response):
-    # Auto modes question solving logic
-    if question_type == "Mathematics":
-        try:
-            question_tokens = short_question.split()
-            total = int(question_tokens[0])  # fist number in equation
-            i = 1
-            while i < len(question_tokens):
-                operation = question_tokens[i]
-                number = int(question_tokens[i + 1])
-                if operation == "+":
-                    total += number
-                elif operation == "-":
-                    total -= number
-                else:
-                    return "", False
-                i += 2
-            correct = str(total)
-        except:
-            return "", False
-
-    elif question_type == "Roman Numerals":
-        try:
-            values = {
-                'I': 1, 'V': 5, 'X': 10, 'L': 50,
-                'C': 100, 'D': 500, 'M': 1000
-            }
-            total = 0
-            prev = 0
-            for char in reversed(short_question):
-                value = values.get(char, 0)
-                if value < prev:
-                    total -= value
-                else:
-                    total += value
-                    prev = value
-            correct = str(total)
-        except:
-            correct = ""
-
-    elif question_type == "Usable IP Addresses of a Subnet":
-        try:
-            ip, prefix = short_question.split("/")
-            prefix = int(prefix)
+def record_question(room, index, question):
+    event_log.record("question", room=room.room_id, index=index, question_type=question.question_type,
+                     short_question=question.short_question, answer=question.answer)
 
-            total = 2 ** (32 - prefix)
 
-            usable_ip_address = total - 2 if prefix < 31 else total  # handles special cases
+def record_finished(room):
+    standings = [[rank, player["leaderboard_key"][1], player["username"], score]
+                 for rank, player, score in room.leaderboard.ranked()]
+    event_log.record("finished", room=room.room_id, standings=standings)
 
-            correct = str(usable_ip_address)
-        except:
-            correct = ""
 
-    elif question_type == "Network and Broadcast Address of a Subnet":
-        correct = solve_network_broadcast(short_question)  # complex logic handled by helper function
+def mark_question_sent(room, start_ns):
+    # Each players answer time starts once the question was handed to their socket. A delivery from before start_ns
+    # belongs to an earlier message, the question never reached that player so they get no answer time
+    for player in room.players:
+        delivered_ns = player.get("delivered_ns")
+        player["question_sent_ns"] = delivered_ns if delivered_ns is not None and delivered_ns >= start_ns else None
 
-    else:
-        correct = ""
 
-    return correct, player_response == correct
+def load_phase_seconds(config):
+    return {**PHASE_SECONDS, **config.get("phase_seconds", {})}
 
 
-def solve_network_broadcast(short_question):
-    # helper for evaluate answer for some complex logic
-    try:
-        ip_str, prefix = short_question.split("/")
-        prefix = int(prefix)
+def phase_delay(previous_start, seconds):
+    # Time left until a phase may start, measured on the monotonic clock from when the previous phase started
+    return max(0.0, previous_start + seconds - time.monotonic())
 
-        # Convert IP to integer
-        ip_parts = list(map(int, ip_str.split(".")))
-        ip_int = (ip_parts[0] << 24) | (ip_parts[1] << 16) | (ip_parts[2] << 8) | ip_parts[3]
 
-        # Create subnet mask
-        mask = (0xFFFFFFFF << (32 - prefix)) & 0xFFFFFFFF
+def wait_for_phase(previous_start, seconds):
+    time.sleep(phase_delay(previous_start, seconds))
+    return time.monotonic()
 
-        # Calculate network and broadcast
-        network_int = ip_int & mask
-        broadcast_int = ip_int | (~mask & 0xFFFFFFFF)
 
-        def int_to_ip(number):
-            # Convert back to dotted format in helper
-            return f"{(number >> 24) & 0xFF}.{(number >> 16) & 0xFF}.{(number >> 8) & 0xFF}.{number & 0xFF}"
+def build_ready_message(config):
+    return {"message_type": "READY", "info": config["ready_info"].format(**config)}
 
-        return f"{int_to_ip(network_int)} and {int_to_ip(broadcast_int)}"
-    except:
-        return ""
 
+def build_question_message(config, index, question):
+    question_type = question.question_type
+    short_question = question.short_question
+    question_format = config["question_formats"][question_type].format(short_question)
+    trivia_question = f"{config['question_word']} {index + 1} ({question_type}):\n{question_format}"
 
-def send_results(player_responses, short_question, question_type, config):
-    # sends results of users responses to question
-    for player in players:
-        username = player["username"]
-        connection = player["connection"]
-        player_response = player_responses.get(username)
-        if player_response is None:  # player didn't answer so don't send a message
+    return {
+        "message_type": "QUESTION",
+        "question_type": question_type,
+        "trivia_question": trivia_question,
+        "short_question": short_question,
+        "time_limit": config["question_seconds"]
+    }
+
+
+def create_question_pool(room, config):
+    # A fixed "question_seed" in the config replays the same questions every game, otherwise each game gets its own
+    room.question_pool = questions.QuestionPool(config["question_types"], config.get("question_seed"))
+    print(f"Room {room.room_id}: question seed {room.question_pool.seed}")
+
+
+def collect_player_responses(room, time_limit):
+    answers = {}
+    deadline = time.monotonic() + time_limit + 0.5  # provides slightly more than time limit in case response still arriving
+
+    with room.lock:  # snapshot players so the lock isn't held while waiting on sockets
+        round_players = list(room.players)
+
+    # Selector only wakes for sockets that actually have data, instead of polling every player in turn
+    selector = selectors.DefaultSelector()
+    pending = set()  # usernames still expected to answer this round
+    for player in round_players:
+        if not player["connected"]:
             continue
+        try:
+            selector.register(player["connection"], selectors.EVENT_READ, player)
+            pending.add(player["username"])
+        except (ValueError, KeyError, OSError):
+            continue  # connection already closed or registered twice
 
-        correct_answer, is_correct = evaluate_answer(question_type, short_question, player_response)
+    def answered(player, answer, received_ns):
+        answers[player["username"]] = answer
+        player["answer_received_ns"] = received_ns
+        selector.unregister(player["connection"])
+        pending.discard(player["username"])
 
-        if is_correct:
-            player["score"] += 1
-            feedback = config["correct_answer"].format(answer=player_response)
-        else:
-            feedback = config["incorrect_answer"].format(answer=player_response, correct_answer=correct_answer)
+    try:
+        for key in list(selector.get_map().values()):  # answers that arrived before the select loop, already buffered
+            player = key.data
+            try:
+                answer = read_answer(player)
+            except framing.FrameTooLarge:
+                continue  # the select loop reads the socket again and drops the player
+            if answer is not None:
+                answered(player, answer, time.monotonic_ns())
+
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
 
-        send_json(connection, {
-            "message_type": "RESULT",
-            "correct": is_correct,
-            "feedback": feedback
-        })
+            for key, _ in selector.select(timeout=remaining):
+                player = key.data
+                received_ns = time.monotonic_ns()  # timestamp on arrival, before any parsing
+                answer = None
+                try:
+                    connected = framing.receive_into(key.fileobj, player["buffer"])
+                    answer = read_answer(player)
+                except (BlockingIOError, socket.timeout):
+                    continue
+                except framing.FrameTooLarge:  # a client flooding one huge line is treated as gone
+                    metrics.DROPPED_TOO_LARGE.inc()
+                    connected = False
+                except OSError:
+                    connected = False
+
+                if answer is not None:
+                    answered(player, answer, received_ns)
+                elif not connected:  # disconnected, stop waiting for them
+                    selector.unregister(key.fileobj)
+                    pending.discard(player["username"])
+    finally:
+        selector.close()
 
+    return answers
 
-def send_leaderboard(config):
-    sorted_players = sorted(players, key=lambda p: (-p["score"], p["username"]))  # sort by score and lexicographically
-    state_lines = []
 
-    rank = 1
-    prev_score = None  # used to check what each players rank is in tie situation
-    same_score_count = 0  # used for ranking players if multiple people have same rank
+def read_answer(player):
+    # First ANSWER among the messages buffered for a player, anything after it stays buffered for later
+    for message in player["buffer"].messages():
+        if message.get("message_type") == "ANSWER":
+            if "answer" in message:
+                return message["answer"]
+            metrics.DROPPED_MALFORMED.inc()
+        elif message.get("message_type") == "LEADERBOARD_REQUEST":
+            player["leaderboard_snapshot"] = True  # lost track, gets every entry next round
+        elif message.get("message_type") != "BYE":  # BYE is followed by the connection closing
+            metrics.DROPPED_UNEXPECTED.inc()
+    return None
 
-    for i, player in enumerate(sorted_players):
-        score = player["score"]
-        noun = config["points_noun_singular"] if score == 1 else config["points_noun_plural"]
 
-        # if new score different, increase same_score_count for a new tie group (if existing)
-        if prev_score is not None and score != prev_score:
-            rank += same_score_count
-            same_score_count = 0
+def discard_stale_answers(room):
+    # Answers that arrived after the last round closed, or a second answer to it, can't count for the next question
+    with room.lock:
+        round_players = [player for player in room.players if player["connected"]]
 
-        # next player score same, therefore must be a tie
-        same_score_count += 1
-        prev_score = score
+    for player in round_players:
+        try:
+            for _ in range(STALE_READS):
+                if not framing.receive_into(player["connection"], player["buffer"]):
+                    break
+        except (BlockingIOError, socket.timeout, OSError):
+            pass  # nothing more waiting, a closed connection is noticed when answers are collected
+        try:
+            while read_answer(player) is not None:
+                metrics.DROPPED_LATE.inc()
+        except framing.FrameTooLarge:
+            pass  # noticed again, and the player dropped, when answers are collected
 
-        state_lines.append(f"{rank}. {player['username']}: {score} {noun}")
 
-    send_json_all_players({
-        "message_type": "LEADERBOARD",
-        "state": "\n".join(state_lines)
-    })
+def evaluate_answer(question_type, short_question, player_response):
+    # Auto modes question solving logic
+    correct = questions.solve_answer(question_type, short_question)
+    return correct, player_response == correct
 
 
-def send_finished(config):
-    with players_threading_lock:
-        sorted_players = sorted(players, key=lambda p: (-p["score"], p["username"]))  # sort lexicographically and by rank
-        top_score = sorted_players[0]["score"]
-        winners = [p["username"] for p in sorted_players if p["score"] == top_score]
+def send_results(room, player_responses, question, config):
+    # sends results of users responses to question
+    answered_players = []
+    for player in room.players:
+        player_response = player_responses.get(player["username"])
+        if player_response is None:  # player didn't answer so don't send a message
+            continue
 
-        if len(winners) == 1:
-            heading = config["one_winner"].format(winners[0])
-        else:
-            heading = config["multiple_winners"].format(", ".join(winners))
+        result_message = build_result_message(room, player, player_response, question, config)
+        queue_payload(player, framing.ENCODERS[player["protocol"]](result_message))
+        answered_players.append(player)
 
-        state_lines = []
-        rank = 1
-        prev_score = None
-        same_score_count = 0
+    flush_players(answered_players)  # all results written together rather than one player at a time
 
-        for i, player in enumerate(sorted_players):
-            score = player["score"]
-            noun = config["points_noun_singular"] if score == 1 else config["points_noun_plural"]
 
-            # follows same logic as leaderboard
-            if prev_score is not None and score != prev_score:
-                rank += same_score_count
-                same_score_count = 0
+def build_result_message(room, player, player_response, question, config):
+    # grades a single answer against the answer worked out at generation, updating the players score
+    correct_answer = question.answer
+    is_correct = question.is_correct(player_response)
+    latency_ns = answer_latency_ns(player)
+    latency_ms = None if latency_ns is None else round(latency_ns / 1e6, 1)
+    if latency_ns is not None:
+        metrics.ANSWER_LATENCY_SECONDS.observe(latency_ns / 1e9)
+    points = award_points(latency_ns, config) if is_correct else 0
 
-            same_score_count += 1
-            prev_score = score
+    if is_correct:
+        player["score"] += points
+        room.leaderboard.update(player)  # only players who scored move in the standings
+        feedback = config["correct_answer"].format(answer=player_response, points=points, latency_ms=latency_ms)
+    else:
+        feedback = config["incorrect_answer"].format(answer=player_response, correct_answer=correct_answer,
+                                                     latency_ms=latency_ms)
+
+    event_log.record("answer", room=room.room_id, player=player["leaderboard_key"][1], answer=player_response,
+                     latency_ns=latency_ns, correct=is_correct, points=points, score=player["score"])
+
+    return {
+        "message_type": "RESULT",
+        "correct": is_correct,
+        "feedback": feedback,
+        "points": points,
+        "latency_ms": latency_ms
+    }
+
+
+def answer_latency_ns(player):
+    # Time from the question reaching the players socket until their answer arrived, both on the monotonic clock
+    sent_ns = player.get("question_sent_ns")
+    received_ns = player.get("answer_received_ns")
+    if sent_ns is None or received_ns is None:
+        return None
+    return max(0, received_ns - sent_ns)  # the asyncio engine can read an answer before its send finished draining
+
+
+def award_points(latency_ns, config):
+    # One point per correct answer, or with "scoring": "speed" up to "speed_points" falling to half at the time limit
+    if config.get("scoring", "flat") != "speed":
+        return 1
+
+    max_points = config.get("speed_points", SPEED_POINTS)
+    if latency_ns is None:
+        return round(max_points / 2)
+    fraction = min(1.0, latency_ns / (config["question_seconds"] * 1e9))
+    return round(max_points * (1 - fraction / 2))
+
+
+def send_leaderboard(room, config, index):
+    targets = [player for player in room.players if player["connected"]]
+    for player, payload in build_leaderboard_payloads(room, targets, config, index):
+        queue_payload(player, payload)
+    flush_players(targets)
+
+
+def build_leaderboard_payloads(room, targets, config, index):
+    # Pairs each player with their LEADERBOARD bytes, identical messages are only encoded once
+    changes = room.leaderboard.take_changes()
+    legacy = [player for player in targets if not player["leaderboard_delta"]]
+    delta = [player for player in targets if player["leaderboard_delta"]]
+    payloads = []
+
+    if legacy:  # the full text is only built when some player still wants it
+        shared_message, own_rank_messages = build_leaderboard_messages(room, config)
+        shared_payloads = {}
+        for player in legacy:
+            own_message = own_rank_messages.get(player["leaderboard_key"])
+            if own_message:
+                payloads.append((player, framing.ENCODERS[player["protocol"]](own_message)))
+            else:
+                payloads.append((player, framing.encode_for(player["protocol"], shared_message, shared_payloads)))
+
+    if delta:
+        # Every entry on the first round, every "leaderboard_full_rounds" rounds and when asked, otherwise changes only
+        full_rounds = config.get("leaderboard_full_rounds", 10)
+        periodic = bool(full_rounds) and index % full_rounds == 0
+        snapshot = None
+        snapshot_payloads, delta_payloads = {}, {}  # protocol -> encoded message
+        delta_message = {"message_type": "LEADERBOARD", "round": index, "changes": changes}
+        for player in delta:
+            protocol = player["protocol"]
+            if "leaderboard_round" not in player or player.get("leaderboard_snapshot") or periodic:
+                if snapshot is None:
+                    snapshot = build_leaderboard_snapshot(room, config, index)
+                snapshot_payload = framing.encode_for(protocol, snapshot, snapshot_payloads)
+                if "leaderboard_round" not in player or player.get("leaderboard_snapshot"):
+                    snapshot_payload = with_player_id(snapshot_payload, player)
+                    player["leaderboard_snapshot"] = False
+                payloads.append((player, snapshot_payload))
+            else:
+                payloads.append((player, framing.encode_for(protocol, delta_message, delta_payloads)))
+            player["leaderboard_round"] = index
+
+    return payloads
+
+
+def build_leaderboard_snapshot(room, config, index):
+    entries = [[player["leaderboard_key"][1], player["username"], score]
+               for _, player, score in room.leaderboard.ranked()]
+    return {
+        "message_type": "LEADERBOARD",
+        "round": index,
+        "entries": entries,
+        "top": config.get("leaderboard_top"),
+        "points_nouns": [config["points_noun_singular"], config["points_noun_plural"]]
+    }
+
+
+def with_player_id(payload, player):
+    # Splices the players own join number into an encoded snapshot instead of encoding every entry again per player
+    if player["protocol"] == "compact":
+        return framing.add_compact_field(payload, "player_id", player["leaderboard_key"][1])
+    return b'{"player_id": %d, ' % player["leaderboard_key"][1] + payload[1:]
+
+
+def build_leaderboard_messages(room, config):
+    # Top "leaderboard_top" players when configured (otherwise everyone), plus a message per player ranked below it
+    top = config.get("leaderboard_top")
+    top_lines = [format_standing(rank, player, score, config) for rank, player, score in room.leaderboard.ranked(top)]
+    state = "\n".join(top_lines)
+
+    own_rank_messages = {}
+    if top is not None and len(room.leaderboard) > top:
+        for player in room.players:
+            if player["connected"] and room.leaderboard.position(player) >= top:
+                own_line = format_standing(room.leaderboard.rank(player), player, player["score"], config)
+                own_rank_messages[player["leaderboard_key"]] = {
+                    "message_type": "LEADERBOARD",
+                    "state": f"{state}\n...\n{own_line}"
+                }
+
+    return {"message_type": "LEADERBOARD", "state": state}, own_rank_messages
+
+
+def build_leaderboard_message(room, config):
+    # Full standings, ranks are shared by ties (1, 1, 3) and ties are ordered by username
+    state_lines = [format_standing(rank, player, score, config) for rank, player, score in room.leaderboard.ranked()]
+    return {
+        "message_type": "LEADERBOARD",
+        "state": "\n".join(state_lines)
+    }
 
-            state_lines.append(f"{rank}. {player['username']}: {score} {noun}")
 
-        final = f"{config['final_standings_heading']}\n" + "\n".join(state_lines) + f"\n{heading}"
+def format_standing(rank, player, score, config):
+    return leaderboard.format_standing(rank, player["username"], score, config["points_noun_singular"],
+                                       config["points_noun_plural"])
 
-        send_json_all_players({
-            "message_type": "FINISHED",
-            "final_standings": final
-        })
 
-        for player in players:
+def send_finished(room, config):
+    send_json_all_players(room, build_finished_message(room, config))
+    record_finished(room)  # standings outlive the connections closed below
+
+    with room.lock:
+        for player in room.players:
             player["connection"].close()
 
-        players.clear()
+        room.players.clear()
+
+
+def build_finished_message(room, config):
+    winners = [player["username"] for player in room.leaderboard.winners()]
+
+    if len(winners) == 1:
+        heading = config["one_winner"].format(winners[0])
+    else:
+        heading = config["multiple_winners"].format(", ".join(winners))
+
+    standings = build_leaderboard_message(room, config)["state"]  # final standings always list every player
+    final = f"{config['final_standings_heading']}\n{standings}\n{heading}"
+
+    return {
+        "message_type": "FINISHED",
+        "final_standings": final
+    }
 
 
 if __name__ == "__main__":
@@ -1,4 +1,7 @@
 import unittest
+import asyncio
+import collections
+import errno
 import subprocess
 import sys
 import io
@@ -6,9 +9,10 @@ import os
 import time
 import socket
 import json
+import random
 import tempfile
 import threading
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import HTTPServer, ThreadingHTTPServer, BaseHTTPRequestHandler
 
 # Paths to files
 ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) if __file__ else os.getcwd()
@@ -21,6 +25,30 @@ sys.path.insert(0, ROOT)
 from client import ask_ollama
 from server import evaluate_answer
 from client import input_handler_with_timeouts
+from client import evaluate_answer as client_evaluate_answer
+import answer_cache
+import client as client_module
+import framing
+import handshake
+import llm_proxy
+import ollama
+import ollama_client
+import rooms
+import server
+import workers
+import leaderboard
+import loadgen
+import metrics
+import event_log
+import replay
+from leaderboard import Leaderboard
+import questions
+import solvers
+
+try:
+    import batch_solver
+except ImportError:  # numpy is only needed for the batch solver
+    batch_solver = None
 
 
 class TestClientWithOllama(unittest.TestCase):
@@ -28,7 +56,7 @@ class TestClientWithOllama(unittest.TestCase):
     def setUpClass(cls):
         # Start ollama.py
         cls.ollama_proc = subprocess.Popen([sys.executable, OLLAMA_PY], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        time.sleep(0.2)  # give server time to set up
+        wait_for_port(8000)
 
     @classmethod
     def tearDownClass(cls):
@@ -79,11 +107,267 @@ class TestClientTimeoutBehavior(unittest.TestCase):
         self.assertIsNone(res)
 
 
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # connections stay open between requests like a real Ollama
+    requests = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        KeepAliveHandler.requests.append((self.client_address, payload))
+        body = json.dumps({"message": {"role": "assistant", "content": "42"}, "done": True}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TestOllamaClient(unittest.TestCase):
+
+    def test_connection_reused_with_keep_alive(self):
+        KeepAliveHandler.requests = []
+        http_server = HTTPServer(('127.0.0.1', 8002), KeepAliveHandler)
+        threading.Thread(target=http_server.serve_forever, daemon=True).start()
+        config = {"ollama_host": "127.0.0.1", "ollama_port": 8002, "ollama_model": "mock", "ollama_keep_alive": "30m"}
+        try:
+            self.assertEqual([ask_ollama(config, "6 * 7", time_limit=2) for _ in range(3)], ["42"] * 3)
+        finally:
+            ollama_client.get_client(config).close()
+            http_server.shutdown()
+            http_server.server_close()
+        self.assertEqual(len({address for address, _ in KeepAliveHandler.requests}), 1)  # one connection
+        self.assertEqual(KeepAliveHandler.requests[0][1]["keep_alive"], "30m")
+
+    def test_deadline_off_main_thread(self):
+        # SIGALRM only works on the main thread, the deadline must hold on any thread
+        http_server = HTTPServer(('127.0.0.1', 8003), SlowHandler)
+        threading.Thread(target=http_server.serve_forever, daemon=True).start()
+        config = {"ollama_host": "127.0.0.1", "ollama_port": 8003, "ollama_model": "mock"}
+        results = []
+        start = time.monotonic()
+        asking = threading.Thread(target=lambda: results.append(ask_ollama(config, "slow", time_limit=0.5)))
+        asking.start()
+        asking.join(timeout=5)
+        elapsed = time.monotonic() - start
+        http_server.shutdown()
+        http_server.server_close()
+        self.assertEqual(results, [None])
+        self.assertLess(elapsed, 1.5)
+
+
+class StreamingHandler(BaseHTTPRequestHandler):
+    # streams the answer then keeps chattering slowly, like a model that won't stop explaining
+    pieces = ["73 + 33", " + 64 = 1", "70", ".", " To work this out"]
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        try:
+            for piece in self.pieces:
+                line = {"message": {"role": "assistant", "content": piece}, "done": False}
+                self.wfile.write(json.dumps(line).encode('utf-8') + b"\n")
+                time.sleep(0.05)
+            time.sleep(3)
+            self.wfile.write(json.dumps({"message": {"content": " first add"}, "done": True}).encode('utf-8'))
+        except OSError:
+            pass  # the client hung up once it had the answer
+
+
+class TestAnswerExtraction(unittest.TestCase):
+
+    def test_waits_for_whole_number(self):
+        for text, done, expected in [("12", False, None), ("12\n", False, "12"), ("73 + 33 = ", False, None),
+                                     ("73 + 33 = 106.", True, "106"), ("It is 3,117 in total", False, "3117"),
+                                     ("5 - 10 = -5 ", False, None), ("5 - 10 = -5 so", False, "-5"), ("3117", True, "3117"), ("no idea", True, None),
+                                     ("2^8 - 2 = 254", True, "254"), ("$2^{8}-2=254$", True, "254"),
+                                     ("**8**", False, None), ("**8**", True, "8"), ("It is __12__ points", False, "12"),
+                                     ("1 + 1 = 2, so 2 * 3 = 6.", True, "6"), ("2*3*4 = 24", True, "24")]:
+            self.assertEqual(questions.extract_answer("Mathematics", text, done), expected, text)
+
+    def test_address_pair_skips_question(self):
+        text = "For 14.199.221.1/31, network 14.199.221.0 and broadcast 14.199.221.1"
+        question_type = "Network and Broadcast Address of a Subnet"
+        self.assertIsNone(questions.extract_answer(question_type, text, False))  # the last octet may continue
+        self.assertEqual(questions.extract_answer(question_type, text + ".", False),
+                         evaluate_answer(question_type, "14.199.221.1/31", None)[0])
+
+    def test_stream_abandoned_once_answered(self):
+        http_server = ThreadingHTTPServer(('127.0.0.1', 8004), StreamingHandler)
+        threading.Thread(target=http_server.serve_forever, daemon=True).start()
+        config = {"ollama_host": "127.0.0.1", "ollama_port": 8004, "ollama_model": "mock"}
+        start = time.monotonic()
+        try:
+            answer = ask_ollama(config, "73 + 33 + 64", 2, "Mathematics")
+        finally:
+            http_server.shutdown()
+            http_server.server_close()
+        self.assertEqual(answer, "170")
+        self.assertLess(time.monotonic() - start, 1)
+
+
+class TestLlmProxy(unittest.TestCase):
+
+    def setUp(self):
+        self.upstream = ThreadingHTTPServer(('127.0.0.1', 8005), StreamingHandler)
+        self.proxy = llm_proxy.create_proxy({"port": 8006, "upstream_port": 8005, "max_concurrency": 1})
+        for http_server in (self.upstream, self.proxy):
+            threading.Thread(target=http_server.serve_forever, daemon=True).start()
+        self.config = {"ollama_host": "127.0.0.1", "ollama_port": 8006, "ollama_model": "mock"}
+
+    def tearDown(self):
+        for http_server in (self.proxy, self.upstream):
+            http_server.shutdown()
+            http_server.server_close()
+
+    def test_identical_prompts_share_one_upstream_call(self):
+        before = (llm_proxy.UPSTREAM_REQUESTS.value, llm_proxy.COALESCED.value, llm_proxy.UPSTREAM_ABANDONED.value)
+        answers = []
+        players = [threading.Thread(target=lambda: answers.append(ask_ollama(self.config, "73 + 33 + 64", 2,
+                                                                             "Mathematics")))
+                   for _ in range(10)]
+        for player in players:
+            player.start()
+        for player in players:
+            player.join(timeout=5)
+
+        self.assertEqual(answers, ["170"] * 10)
+        self.assertEqual(llm_proxy.UPSTREAM_REQUESTS.value - before[0], 1)
+        self.assertEqual(llm_proxy.COALESCED.value - before[1], 9)
+        time.sleep(0.2)
+        self.assertEqual(llm_proxy.UPSTREAM_ABANDONED.value - before[2], 1)  # nobody waited for the chatter
+
+    def test_whole_reply_put_back_together(self):
+        StreamingHandler.pieces, pieces = ["1", "7", "0"], StreamingHandler.pieces
+        client = ollama_client.OllamaClient("127.0.0.1", 8006)
+        try:
+            reply = client.chat("mock", "Evaluate 73 + 33 + 64", time.monotonic() + 5)
+        finally:
+            StreamingHandler.pieces = pieces
+            client.close()
+        self.assertEqual(reply, "170 first add")
+        self.assertIn("llm_proxy_queue_depth 0", llm_proxy.REGISTRY.render())
+
+    def test_queued_request_dropped_once_players_hang_up(self):
+        proxy = llm_proxy.Proxy({"upstream_port": 8013})  # nothing listens there, it must not be asked
+        payload = {"model": "mock", "messages": [{"role": "user", "content": "Evaluate 1 + 1"}]}
+        requests_before = llm_proxy.UPSTREAM_REQUESTS.value
+        with proxy.slots:  # the only upstream slot is busy, so the call queues
+            flight = proxy.join(payload)
+            proxy.leave(flight)
+            self.assertNotIn(flight.key, proxy.flights)  # an identical request doesn't join the abandoned call
+            second = proxy.join(payload)
+            self.assertIsNot(second, flight)
+            proxy.leave(second)
+
+        for abandoned in (flight, second):
+            self.assertEqual(abandoned.wait_lines(0, 2), ([], True))
+        self.assertEqual(llm_proxy.UPSTREAM_REQUESTS.value, requests_before)
+        self.assertEqual(proxy.flights, {})
+
+
+class TestMockOllama(unittest.TestCase):
+
+    def start_mock(self, port, **config):
+        # in process mock server, returns the ollama_config pointing at it
+        http_server = ollama.create_mock(dict(config, port=port, seed=1))
+        threading.Thread(target=http_server.serve_forever, daemon=True).start()
+        ollama_config = {"ollama_host": "127.0.0.1", "ollama_port": port, "ollama_model": "mock"}
+        self.addCleanup(http_server.server_close)
+        self.addCleanup(http_server.shutdown)
+        self.addCleanup(ollama_client.get_client(ollama_config).close)
+        return ollama_config
+
+    def test_answers_every_question_type(self):
+        config = self.start_mock(8007, reply="Sure! The answer is {answer}. To work it out, first", token_seconds=0.3)
+        rng = random.Random(1112)
+        start = time.monotonic()
+        for question_type in questions.QUESTION_TYPES:
+            short_question = questions.QUESTION_TYPES[question_type].generator(rng)
+            self.assertEqual(ask_ollama(config, short_question, 5, question_type),
+                             evaluate_answer(question_type, short_question, None)[0])
+        self.assertLess(time.monotonic() - start, 4 * 8 * 0.3)  # every reply cut short after its answer
+
+    def test_injected_timeouts_and_errors(self):
+        timing_out = self.start_mock(8008, timeout_rate=1.0, timeout_seconds=2)
+        failing = self.start_mock(8009, error_rate=1.0)
+        start = time.monotonic()
+        self.assertIsNone(ask_ollama(timing_out, "1 + 1", 0.3, "Mathematics"))
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertIsNone(ask_ollama(failing, "1 + 1", 1, "Mathematics"))
+
+    def test_concurrency_limit_queues_requests(self):
+        config = self.start_mock(8010, latency={"distribution": "fixed", "seconds": 0.2}, concurrency=1)
+        answers = []
+        askers = [threading.Thread(target=lambda: answers.append(ask_ollama(config, "1 + 1", 5, "Mathematics")))
+                  for _ in range(3)]
+        start = time.monotonic()
+        for asker in askers:
+            asker.start()
+        for asker in askers:
+            asker.join(timeout=5)
+        self.assertEqual(answers, ["2"] * 3)
+        self.assertGreaterEqual(time.monotonic() - start, 0.6)
+
+    def test_only_correct_answers_cached(self):
+        wrong_config = self.start_mock(8011, reply="{answer}0")
+        right_config = self.start_mock(8012)
+        client_module.cache = answer_cache.AnswerCache()
+        self.addCleanup(setattr, client_module, "cache", None)
+
+        self.assertEqual(ask_ollama(wrong_config, "1 + 1", 2, "Mathematics"), "20")
+        self.assertIsNone(client_module.cache.get("mock", "Mathematics", "1 + 1"))
+        self.assertEqual(ask_ollama(right_config, "1 + 1", 2, "Mathematics"), "2")
+        self.assertEqual(client_module.cache.get("mock", "Mathematics", "1 + 1"), "2")
+
+
+class TestAnswerCache(unittest.TestCase):
+
+    def test_lru_and_ttl(self):
+        cache = answer_cache.AnswerCache(max_entries=2, ttl_seconds=60)
+        cache.put("m", "Mathematics", "1 + 1", "2")
+        cache.put("m", "Mathematics", "2 + 2", "4")
+        self.assertEqual(cache.get("m", "Mathematics", " 1  +  1 "), "2")  # whitespace doesn't matter
+        cache.put("m", "Mathematics", "3 + 3", "6")  # "2 + 2" was used least recently
+        self.assertIsNone(cache.get("m", "Mathematics", "2 + 2"))
+        self.assertIsNone(cache.get("other model", "Mathematics", "1 + 1"))
+
+        cache.put("m", "Mathematics", "4 + 4", "8", stored=time.time() - 61)
+        self.assertIsNone(cache.get("m", "Mathematics", "4 + 4"))
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 3)
+
+    def test_preseed_and_persistence(self):
+        path = os.path.join(tempfile.mkdtemp(), "cache.json")
+        cache = answer_cache.AnswerCache(path=path)
+        cache.preseed("m", "Usable IP Addresses of a Subnet", answer_cache.usable_address_questions(),
+                      client_evaluate_answer)
+        cache.save()
+
+        loaded = answer_cache.AnswerCache(path=path)
+        loaded.load()
+        self.assertEqual(loaded.stats()["entries"], 33)
+        for short_question in ("10.1.2.3/24", "192.168.7.9/30", "8.8.8.8/32"):  # any address with the same prefix
+            self.assertEqual(loaded.get("m", "Usable IP Addresses of a Subnet", short_question),
+                             client_evaluate_answer("Usable IP Addresses of a Subnet", short_question))
+
+
 class TestServerIntegration(unittest.TestCase):
+    port = 8890
+    engine = "threads"
+    workers = 1
+
     def setUp(self):
         # create a small temporary config so the game runs fast
         config = {
-            "port": 8890,
+            "port": self.port,
             "players": 2,
             "question_types": ["Mathematics"],
             "question_formats": {"Mathematics": "Evaluate {}"},
@@ -104,8 +388,8 @@ class TestServerIntegration(unittest.TestCase):
         self.config_file.close()
 
         # start server.py with this config
-        self.server_process = subprocess.Popen([sys.executable, SERVER_PY, '--config', self.config_file.name], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        time.sleep(0.2)
+        self.server_process = subprocess.Popen([sys.executable, SERVER_PY, '--config', self.config_file.name, '--engine', self.engine, '--workers', str(self.workers)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        wait_for_port(self.port)
 
     def tearDown(self):
         try:
@@ -120,8 +404,8 @@ class TestServerIntegration(unittest.TestCase):
 
     def test_two_clients_connect_and_receive_question(self):
         # Connect two raw sockets to the server and send HI messages
-        sock_1 = socket.create_connection(('127.0.0.1', 8890), timeout=2)
-        sock_2 = socket.create_connection(('127.0.0.1', 8890), timeout=2)
+        sock_1 = socket.create_connection(('127.0.0.1', self.port), timeout=2)
+        sock_2 = socket.create_connection(('127.0.0.1', self.port), timeout=2)
 
         send_json(sock_1, {"message_type": "HI", "username": "Tester1"})
         send_json(sock_2, {"message_type": "HI", "username": "Tester2"})
@@ -169,6 +453,105 @@ class TestServerIntegration(unittest.TestCase):
         sock_2.close()
 
 
+    def test_non_object_frames_before_hi_are_skipped(self):
+        # valid JSON that isn't an object must not take the server down, later players are still admitted
+        junk = socket.create_connection(('127.0.0.1', self.port), timeout=2)
+        junk.sendall(b'5\n[]\n"HI"\n')
+        time.sleep(0.2)
+        sock_1 = socket.create_connection(('127.0.0.1', self.port), timeout=2)
+        sock_2 = socket.create_connection(('127.0.0.1', self.port), timeout=2)
+        send_json(sock_1, {"message_type": "HI", "username": "Tester1"})
+        send_json(sock_2, {"message_type": "HI", "username": "Tester2"})
+        for sock in (sock_1, sock_2):
+            self.assertEqual(receive_message(sock, framing.MessageBuffer(), timeout=3).get('message_type'), 'READY')
+
+        for sock in (junk, sock_1, sock_2):
+            sock.close()
+
+    def test_answer_without_answer_field_does_not_stall_room(self):
+        # the room times the silent player out and finishes, instead of its game dying on the bad answers
+        sock_1 = socket.create_connection(('127.0.0.1', self.port), timeout=2)
+        sock_2 = socket.create_connection(('127.0.0.1', self.port), timeout=2)
+        send_json(sock_1, {"message_type": "HI", "username": "Tester1"})
+        send_json(sock_2, {"message_type": "HI", "username": "Tester2"})
+        buffers = [framing.MessageBuffer(), framing.MessageBuffer()]
+        for sock, buffer in zip((sock_1, sock_2), buffers):
+            self.assertEqual(receive_message(sock, buffer, timeout=3).get('message_type'), 'READY')
+        sock_1.sendall(b'{"message_type": "ANSWER"}\n{"message_type": "ANSWER"}\n')  # buffered before the question
+        question = None
+        for sock, buffer in zip((sock_1, sock_2), buffers):
+            question = receive_message(sock, buffer, timeout=5)
+            self.assertEqual(question.get('message_type'), 'QUESTION')
+
+        send_json(sock_2, {"message_type": "ANSWER",
+                           "answer": evaluate_answer(question['question_type'], question['short_question'], None)[0]})
+        for sock, buffer in zip((sock_1, sock_2), buffers):
+            message = receive_message(sock, buffer, timeout=5)
+            while message is not None and message.get('message_type') != 'FINISHED':
+                message = receive_message(sock, buffer, timeout=5)
+            self.assertIsNotNone(message)
+
+        sock_1.close()
+        sock_2.close()
+
+    def test_loadgen_swarm_finishes_game(self):
+        # a small synthetic swarm from loadgen.py plays a whole game over the real protocol
+        config = {"port": self.port, "players": 2, "answer_delay": {"distribution": "uniform", "min": 0, "max": 0.2},
+                  "correct_rate": 0.5, "timeout_seconds": 10, "seed": 1}
+        stats = asyncio.run(loadgen.run(config))
+        self.assertEqual(stats["finished"], 2)
+        self.assertEqual(len(stats["join_ns"]), 2)
+        self.assertEqual(len(stats["result_ns"]), 2)
+        self.assertFalse(stats["failures"])
+
+    def test_compact_and_json_clients_share_room(self):
+        # one client asks for compact frames in HI, the other keeps JSON lines, both play the same game
+        sock_1 = socket.create_connection(('127.0.0.1', self.port), timeout=2)
+        sock_2 = socket.create_connection(('127.0.0.1', self.port), timeout=2)
+        send_json(sock_1, {"message_type": "HI", "username": "Compact", "protocol": "compact",
+                           "leaderboard": "delta"})
+        send_json(sock_2, {"message_type": "HI", "username": "Json"})
+        buffer_1 = framing.MessageBuffer()
+
+        ready = receive_message(sock_1, buffer_1, timeout=3)
+        self.assertEqual(ready.get('message_type'), 'READY')
+        self.assertEqual(receive_json_line(sock_2, timeout=3).get('message_type'), 'READY')
+
+        question = receive_message(sock_1, buffer_1, timeout=5)
+        self.assertEqual(question.get('message_type'), 'QUESTION')
+        self.assertEqual(receive_json_line(sock_2, timeout=5)['short_question'], question['short_question'])
+
+        correct_answer, _ = evaluate_answer(question['question_type'], question['short_question'], None)
+        send_json(sock_1, {"message_type": "ANSWER", "answer": correct_answer})
+        result = receive_message(sock_1, buffer_1, timeout=3)
+        self.assertEqual(result.get('message_type'), 'RESULT')
+        self.assertTrue(result['correct'])
+
+        standings = leaderboard.RemoteStandings()
+        for _ in range(3):  # a leaderboard snapshot comes before FINISHED
+            message = receive_message(sock_1, buffer_1, timeout=3)
+            if message.get('message_type') == 'LEADERBOARD':
+                self.assertIn("Compact: 1 point", standings.apply(message))
+            if message.get('message_type') == 'FINISHED':
+                break
+        self.assertEqual(message.get('message_type'), 'FINISHED')
+
+        sock_1.close()
+        sock_2.close()
+
+
+class TestAsyncServerIntegration(TestServerIntegration):
+    # same game flow run against the asyncio engine
+    port = 8892
+    engine = "asyncio"
+
+
+class TestWorkersServerIntegration(TestServerIntegration):
+    # same game flow with the room handed off to one of several worker processes
+    port = 8893
+    workers = 2
+
+
 class TestClientEdgeCases(unittest.TestCase):
     def setUp(self):
         config = {
@@ -196,7 +579,7 @@ class TestClientEdgeCases(unittest.TestCase):
             stdout=subprocess.DEVNULL,
             stderr=subprocess.DEVNULL
         )
-        time.sleep(0.3)
+        wait_for_port(config["port"])
 
     def tearDown(self):
         try:
@@ -245,8 +628,539 @@ class TestClientInputSequences(unittest.TestCase):
             sys.stdin = old_stdin
 
 
+class TestFraming(unittest.TestCase):
+
+    def test_coalesced_and_split_lines(self):
+        buffer = framing.LineBuffer()
+        # READY and half a QUESTION arrive in one segment, the rest of the QUESTION in the next
+        buffer.feed(b'{"message_type": "READY"}\n{"message_type": "QUES')
+        self.assertEqual([m["message_type"] for m in buffer.messages()], ["READY"])
+        buffer.feed(b'TION"}\n')
+        self.assertEqual([m["message_type"] for m in buffer.messages()], ["QUESTION"])
+        self.assertEqual(buffer.pending(), 0)
+
+    def test_unread_messages_stay_buffered(self):
+        buffer = framing.LineBuffer()
+        buffer.feed(b'{"message_type": "HI"}\n{"message_type": "ANSWER", "answer": "1"}\n')
+        self.assertEqual(next(buffer.messages())["message_type"], "HI")
+        self.assertEqual(next(buffer.messages())["answer"], "1")
+
+    def test_large_room_frames_reach_players(self):
+        # a 3,000 player FINISHED is well past the client frame limit, the client and loadgen readers still take it
+        room = rooms.Room("r", 3000)
+        for number in range(3000):
+            room.leaderboard.add({"username": f"player-{number}", "score": number % 7})
+        config = {"one_winner": "{}", "multiple_winners": "{}", "final_standings_heading": "Final standings:",
+                  "points_noun_singular": "point", "points_noun_plural": "points"}
+        finished = server.build_finished_message(room, config)
+        payload = framing.encode_message(finished)
+        self.assertGreater(len(payload), framing.MAX_FRAME_SIZE)
+
+        buffer = framing.MessageBuffer(framing.MAX_SERVER_FRAME_SIZE)
+        buffer.feed(framing.encode_compact(finished) + payload)
+        self.assertEqual(list(buffer.messages()), [finished, finished])
+
+        async def read():
+            reader = asyncio.StreamReader(limit=framing.MAX_SERVER_FRAME_SIZE)
+            reader.feed_data(payload)
+            return await loadgen.read_message(reader, collections.Counter())
+        self.assertEqual(asyncio.run(read()), finished)
+
+    def test_frame_too_large(self):
+        buffer = framing.LineBuffer(max_frame_size=16)
+        buffer.feed(b"x" * 32)
+        with self.assertRaises(framing.FrameTooLarge):
+            list(buffer.messages())
+
+    def test_compact_round_trip(self):
+        messages = [
+            {"message_type": "READY", "info": "Game starts in 2 seconds!"},
+            {"message_type": "QUESTION", "question_type": "Mathematics", "trivia_question": "Question 1:\n1 + 2",
+             "short_question": "1 + 2", "time_limit": 10},
+            {"message_type": "RESULT", "correct": False, "feedback": "ünïcode", "points": 0, "latency_ms": 812.4},
+            {"message_type": "RESULT", "correct": True, "feedback": "", "points": 2 ** 70, "latency_ms": None},
+            {"message_type": "LEADERBOARD", "round": 3, "changes": [[0, 5], [2, 1]]},
+            {"message_type": "FINISHED", "final_standings": "1. a: 2 points"},
+            {"message_type": "SOMETHING_NEW", "extra": {"nested": [1, "x"]}},
+        ]
+        buffer = framing.MessageBuffer()
+        for message in messages:
+            payload = framing.encode_compact(message)
+            self.assertLess(len(payload), len(framing.encode_message(message)) + 16)
+            buffer.feed(payload[:3])  # a frame split inside its header still comes out whole
+            buffer.feed(payload[3:] + framing.encode_message(message))
+        self.assertEqual(list(buffer.messages()), [message for message in messages for _ in range(2)])
+
+    def test_compact_player_id_splice(self):
+        snapshot = {"message_type": "LEADERBOARD", "round": 0, "entries": [[0, "a", 1]], "top": None}
+        for message_type in ("LEADERBOARD", "NOT_IN_TABLE"):
+            payload = framing.add_compact_field(framing.encode_compact(dict(snapshot, message_type=message_type)),
+                                                "player_id", 7)
+            buffer = framing.MessageBuffer()
+            buffer.feed(payload)
+            self.assertEqual(next(buffer.messages()), dict(snapshot, message_type=message_type, player_id=7))
+
+
+class TestLobby(unittest.TestCase):
+
+    def test_named_and_auto_matched_rooms(self):
+        lobby = rooms.Lobby(2)
+        room_a, full = lobby.join({"username": "a1", "score": 0}, "a")
+        self.assertFalse(full)
+        auto_room, _ = lobby.join({"username": "x1", "score": 0})
+        self.assertIsNot(auto_room, room_a)
+
+        same_room, full = lobby.join({"username": "a2", "score": 0}, "a")
+        self.assertIs(same_room, room_a)
+        self.assertTrue(full)
+
+        # room "a" is now playing, the next player asking for it starts a fresh game
+        next_room, _ = lobby.join({"username": "a3", "score": 0}, "a")
+        self.assertIsNot(next_room, room_a)
+
+    def test_named_room_apart_from_auto_matched(self):
+        lobby = rooms.Lobby(2)
+        auto_room, _ = lobby.join({"username": "x1", "score": 0})
+        named_room, full = lobby.join({"username": "n1", "score": 0}, auto_room.room_id)
+        self.assertIsNot(named_room, auto_room)
+        self.assertFalse(full)
+        self.assertEqual([player["username"] for player in auto_room.players], ["x1"])
+
+    def test_leave_frees_spot(self):
+        lobby = rooms.Lobby(2)
+        player = {"username": "p1", "score": 0}
+        room, _ = lobby.join(player)
+        lobby.leave(player, room)
+        self.assertEqual(room.players, [])
+
+    def test_dispatcher_refills_room_after_leave(self):
+        # p1 leaves worker 0's room after p2 was already sent there, the dispatcher only hears of it afterwards
+        channels = [socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET) for _ in range(2)]
+        for pair in channels:
+            for channel in pair:
+                self.addCleanup(channel.close)
+        dispatcher = workers.create_dispatcher([parent for parent, _ in channels])
+        lobbies = [workers.WorkerLobby(2, worker) for _, worker in channels]
+
+        def dispatch(username):
+            index = workers.pick_worker(dispatcher, None, 2)
+            player = {"username": username, "score": 0}
+            room, full = lobbies[index].join(player)
+            return index, player, room, full
+
+        _, p1, room, _ = dispatch("p1")
+        lobbies[0].leave(p1, room)
+        self.assertEqual(dispatch("p2")[0], 0)
+        workers.read_report(None, dispatcher, 0)
+        index, _, p3_room, full = dispatch("p3")
+        self.assertEqual((index, full), (0, True))  # joins p2 instead of leaving them waiting alone on worker 0
+        self.assertEqual([player["username"] for player in p3_room.players], ["p2", "p3"])
+        self.assertEqual(dispatch("p4")[0], 1)  # the next room goes to the other worker
+
+
+class FailingListener(socket.socket):
+    # accept fails like a process out of file descriptors until fail_until passes
+    fail_until = 0
+    accepts = 0
+
+    def accept(self):
+        self.accepts += 1
+        if time.monotonic() < self.fail_until:
+            raise OSError(errno.EMFILE, "Too many open files")
+        return super().accept()
+
+
+class TestHandshakeLoop(unittest.TestCase):
+
+    def test_accept_backs_off_when_out_of_descriptors(self):
+        listener = FailingListener(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen()
+        listener.fail_until = time.monotonic() + 0.25
+        hellos = []
+
+        def on_hello(connection, buffer, message, received):
+            hellos.append(message["username"])
+            connection.close()
+            loop.stop()
+
+        loop = handshake.HandshakeLoop(on_hello)
+        loop.add_listener(listener)
+        runner = threading.Thread(target=loop.run, daemon=True)
+        runner.start()
+        with socket.create_connection(listener.getsockname(), timeout=2) as sock:
+            send_json(sock, {"message_type": "HI", "username": "a"})
+            runner.join(timeout=2)
+        listener.close()
+
+        self.assertEqual(hellos, ["a"])  # admitted once accepting works again
+        self.assertLess(listener.accepts, 10)  # a busy loop would have retried thousands of times
+
+
+class TestFlushPlayers(unittest.TestCase):
+
+    def setUp(self):
+        slow_consumer_seconds, server.SLOW_CONSUMER_SECONDS = server.SLOW_CONSUMER_SECONDS, 0.3
+        self.addCleanup(setattr, server, "SLOW_CONSUMER_SECONDS", slow_consumer_seconds)
+
+    def player(self, username):
+        server_side, client_side = socket.socketpair()
+        server_side.setblocking(False)
+        self.addCleanup(server_side.close)
+        self.addCleanup(client_side.close)
+        return {"username": username, "connection": server_side, "outbox": bytearray(), "connected": True}, client_side
+
+    def test_peer_that_never_reads_is_evicted_others_delivered(self):
+        # one message larger than the outbox cap, like FINISHED in a big room, still reaches players that keep up
+        payload = b"x" * (server.MAX_OUTBOX_BYTES * 4)
+        players, peers = zip(*(self.player(username) for username in ("a", "b", "stuck")))
+        received = {}
+
+        def read_all(username, sock):
+            data = bytearray()
+            while len(data) < len(payload):
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+            received[username] = len(data)
+
+        readers = [threading.Thread(target=read_all, args=(player["username"], peer), daemon=True)
+                   for player, peer in zip(players[:2], peers[:2])]
+        for reader in readers:
+            reader.start()
+        for player in players:
+            server.queue_payload(player, payload)
+        stats = server.flush_players(players)
+        for reader in readers:
+            reader.join(timeout=2)
+
+        self.assertEqual(received, {"a": len(payload), "b": len(payload)})
+        self.assertEqual([player["connected"] for player in players], [True, True, False])
+        self.assertEqual(stats["evicted"], ["stuck"])
+        self.assertEqual(set(stats["delivery_ns"]), {"a", "b"})
+        self.assertEqual(stats["skew_ns"], max(stats["delivery_ns"].values()) - min(stats["delivery_ns"].values()))
+
+    def test_player_already_behind_is_evicted(self):
+        player, _ = self.player("behind")
+        player["outbox"] += b"x" * (server.MAX_OUTBOX_BYTES + 1)
+        server.queue_payload(player, b"y")
+        self.assertFalse(player["connected"])
+
+
+class TestCollectAnswers(unittest.TestCase):
+
+    def setUp(self):
+        self.server_side, self.client_side = socket.socketpair()
+        self.server_side.setblocking(False)
+        self.addCleanup(self.server_side.close)
+        self.addCleanup(self.client_side.close)
+        self.room = rooms.Room("r", 1)
+        self.player = {"username": "a", "connection": self.server_side, "buffer": framing.MessageBuffer(),
+                       "connected": True}
+        self.room.players.append(self.player)
+
+    def test_buffered_answer_seen_without_new_bytes(self):
+        # read by the lobby while waiting for the room to fill, nothing more arrives on the socket
+        self.player["buffer"].feed(b'{"message_type": "ANSWER", "answer": "42"}\n')
+        start = time.monotonic()
+        self.assertEqual(server.collect_player_responses(self.room, 2), {"a": "42"})
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    def test_stale_answers_discarded_before_question(self):
+        # a second answer to the last question, buffered and still on the socket, must not answer the next one
+        self.player["buffer"].feed(b'{"message_type": "ANSWER", "answer": "old"}\n')
+        self.client_side.sendall(b'{"message_type": "ANSWER", "answer": "older"}\n')
+        late = metrics.DROPPED_LATE.value
+        server.discard_stale_answers(self.room)
+        self.assertEqual(metrics.DROPPED_LATE.value - late, 2)
+        self.client_side.sendall(b'{"message_type": "ANSWER", "answer": "new"}\n')
+        self.assertEqual(server.collect_player_responses(self.room, 2), {"a": "new"})
+
+
+class TestLeaderboard(unittest.TestCase):
+
+    def test_matches_full_sort(self):
+        # random scoring rounds, order and shared ranks must match sorting every player by (-score, username)
+        rng = random.Random(1112)
+        leaderboard = Leaderboard()
+        players = [{"username": rng.choice("abcdef"), "score": 0} for _ in range(30)]  # repeated usernames
+        for player in players:
+            leaderboard.add(player)
+
+        for _ in range(20):
+            for player in rng.sample(players, 10):
+                player["score"] += 1
+                leaderboard.update(player)
+
+            expected = sorted(players, key=lambda p: (-p["score"], p["username"]))
+            ranked = list(leaderboard.ranked())
+            self.assertEqual([(p["username"], p["score"]) for p in expected],
+                             [(p["username"], score) for _, p, score in ranked])
+            for rank, player, score in ranked:
+                self.assertEqual(rank, 1 + sum(1 for p in players if p["score"] > score))
+                self.assertEqual(leaderboard.rank(player), rank)
+            self.assertEqual(ranked[5][1], expected[leaderboard.position(ranked[5][1])])
+
+        leaderboard.remove(players[0])
+        self.assertEqual(len(list(leaderboard.ranked())), 29)
+
+    def test_top_k_messages(self):
+        config = {"points_noun_singular": "point", "points_noun_plural": "points", "leaderboard_top": 2}
+        room = rooms.Room("r", 3)
+        for username, score in [("a", 2), ("b", 2), ("c", 0)]:
+            player = {"username": username, "score": score, "connected": True}
+            room.players.append(player)
+            room.leaderboard.add(player)
+
+        shared, own_rank = server.build_leaderboard_messages(room, config)
+        self.assertEqual(shared["state"], "1. a: 2 points\n1. b: 2 points")
+        self.assertEqual(list(own_rank.values())[0]["state"], "1. a: 2 points\n1. b: 2 points\n...\n3. c: 0 points")
+
+
+class TestLeaderboardDelta(unittest.TestCase):
+
+    def test_client_rebuilds_full_text(self):
+        # a delta client and a full text client in the same room must print the same standings every round
+        rng = random.Random(1112)
+        config = {"points_noun_singular": "point", "points_noun_plural": "points", "leaderboard_top": 3,
+                  "leaderboard_full_rounds": 4}
+        room = rooms.Room("r", 8)
+        for i in range(8):
+            player = {"username": rng.choice("abc"), "score": 0, "connected": True, "leaderboard_delta": i % 2 == 0,
+                      "protocol": "compact" if i % 4 < 2 else "json"}  # every mix of the two options
+            room.players.append(player)
+            room.leaderboard.add(player)
+        remote = {id(player): leaderboard.RemoteStandings() for player in room.players}
+
+        for index in range(10):
+            for player in rng.sample(room.players, 3):
+                player["score"] += 1
+                room.leaderboard.update(player)
+
+            messages = {id(player): decode_payload(payload)
+                        for player, payload in server.build_leaderboard_payloads(room, room.players, config, index)}
+            shared_message, own_rank_messages = server.build_leaderboard_messages(room, config)
+            for player in room.players:
+                message = messages[id(player)]
+                full_state = own_rank_messages.get(player["leaderboard_key"], shared_message)["state"]
+                if not player["leaderboard_delta"]:
+                    self.assertEqual(message["state"], full_state)
+                    continue
+                self.assertEqual("entries" in message, index % 4 == 0)  # changes only between full rounds
+                self.assertEqual(remote[id(player)].apply(message), full_state)
+
+    def test_missed_round_needs_snapshot(self):
+        standings = leaderboard.RemoteStandings()
+        self.assertIsNone(standings.apply({"message_type": "LEADERBOARD", "round": 3, "changes": []}))
+
+
+class TestSpeedScoring(unittest.TestCase):
+    config = {"question_seconds": 10, "correct_answer": "{answer} is correct! +{points}",
+              "incorrect_answer": "The correct answer is {correct_answer}"}
+
+    def test_points_fall_to_half_at_time_limit(self):
+        speed = dict(self.config, scoring="speed")
+        self.assertEqual(server.award_points(0, self.config), 1)
+        self.assertEqual(server.award_points(0, speed), 1000)
+        self.assertEqual(server.award_points(5 * 10 ** 9, speed), 750)
+        self.assertEqual(server.award_points(30 * 10 ** 9, speed), 500)
+
+    def test_result_carries_latency(self):
+        room = rooms.Room("r", 1)
+        player = {"username": "p", "score": 0, "question_sent_ns": 10 ** 9, "answer_received_ns": 3 * 10 ** 9}
+        room.leaderboard.add(player)
+        question = questions.Question("Mathematics", "1 + 2")
+
+        result = server.build_result_message(room, player, "3", question, dict(self.config, scoring="speed"))
+        self.assertEqual((result["points"], result["latency_ms"]), (900, 2000.0))
+        self.assertEqual(result["feedback"], "3 is correct! +900")
+        self.assertEqual(player["score"], 900)
+        self.assertEqual(server.build_result_message(room, player, "4", question, self.config)["points"], 0)
+
+    def test_answer_time_needs_question_delivered(self):
+        # a player whose last delivery was an earlier message never got the question, so they get no answer time
+        room = rooms.Room("r", 2)
+        room.players = [{"username": "a", "delivered_ns": 5}, {"username": "b", "delivered_ns": 15}, {"username": "c"}]
+        server.mark_question_sent(room, 10)
+        self.assertEqual([player["question_sent_ns"] for player in room.players], [None, 15, None])
+
+
+class TestPhaseTiming(unittest.TestCase):
+
+    def test_phase_seconds_override_defaults(self):
+        self.assertEqual(server.load_phase_seconds({}), server.PHASE_SECONDS)
+        phases = server.load_phase_seconds({"phase_seconds": {"result": 0.5}})
+        self.assertEqual(phases, dict(server.PHASE_SECONDS, result=0.5))  # the others keep their defaults
+        self.assertEqual(server.PHASE_SECONDS["result"], 0.0)  # the defaults themselves are left alone
+
+    def test_delay_counts_from_previous_start(self):
+        now = time.monotonic()
+        self.assertAlmostEqual(server.phase_delay(now, 10), 10, delta=0.5)
+        self.assertAlmostEqual(server.phase_delay(now - 4, 10), 6, delta=0.5)  # time already spent counts
+        self.assertEqual(server.phase_delay(now - 20, 10), 0.0)  # a phase that ran long never waits
+        self.assertEqual(server.phase_delay(now, 0), 0.0)
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_prometheus_text(self):
+        registry = metrics.Registry()
+        counter = registry.counter("test_total", "Counted things", ("reason",))
+        histogram = registry.histogram("test_seconds", "Timed things", buckets=(0.1, 1.0))
+        counter.labels(reason="a").inc()
+        counter.labels(reason="a").inc(2)
+        for value in (0.05, 0.5, 5):
+            histogram.observe(value)
+
+        lines = registry.render().splitlines()
+        self.assertIn('test_total{reason="a"} 3', lines)
+        self.assertIn("# TYPE test_seconds histogram", lines)
+        self.assertEqual([line for line in lines if line.startswith("test_seconds_bucket")],
+                         ['test_seconds_bucket{le="0.1"} 1', 'test_seconds_bucket{le="1.0"} 2',
+                          'test_seconds_bucket{le="+Inf"} 3'])
+        self.assertIn("test_seconds_count 3", lines)
+
+    def test_eviction_counted_once(self):
+        before = metrics.SEND_SLOW_CONSUMER.value
+        player = {"connected": True, "outbox": bytearray(b"x"), "connection": socket.socket()}
+        server.evict_player(player, metrics.SEND_SLOW_CONSUMER)
+        server.evict_player(player, metrics.SEND_SLOW_CONSUMER)
+        self.assertEqual(metrics.SEND_SLOW_CONSUMER.value, before + 1)
+
+
+class TestEventLog(unittest.TestCase):
+
+    def test_logged_game_replays(self):
+        config = {"question_types": ["Mathematics", "Roman Numerals"], "question_seconds": 10, "scoring": "speed",
+                  "question_seed": 1112, "correct_answer": "{answer} is correct!",
+                  "incorrect_answer": "The correct answer is {correct_answer}"}
+        room = rooms.Room("r", 2)
+        for username in ("a", "b"):
+            player = {"username": username, "score": 0, "question_sent_ns": 0}
+            room.players.append(player)
+            room.leaderboard.add(player)
+
+        path = os.path.join(tempfile.mkdtemp(), "events.jsonl")
+        event_log.open_log(path)
+        try:
+            server.create_question_pool(room, config)
+            server.record_game_start(room, config)
+            for i, question_type in enumerate(config["question_types"]):
+                question = room.question_pool.next_question(question_type)
+                server.record_question(room, i, question)
+                for player, response in zip(room.players, (question.answer, "wrong")):
+                    player["answer_received_ns"] = (i + 1) * 10 ** 9
+                    server.build_result_message(room, player, response, question, config)
+            server.record_finished(room)
+        finally:
+            room.question_pool.close()
+            event_log.close_log()
+
+        games = list(replay.read_games(event_log.read_events(path)))
+        self.assertEqual(len(games), 1)
+        self.assertEqual(replay.replay_game(games[0]), [])
+
+        games[0]["questions"][0][1][0]["score"] += 1  # a tampered log is caught
+        self.assertEqual(len(replay.replay_game(games[0])), 1)
+
+
+class TestQuestionPool(unittest.TestCase):
+
+    def test_same_seed_same_questions(self):
+        question_types = ["Mathematics", "Roman Numerals", "Usable IP Addresses of a Subnet"]
+        pool_1 = questions.QuestionPool(question_types, seed=1112)
+        pool_2 = questions.QuestionPool(question_types, seed=1112, batch_size=1)  # refills at different times
+        try:
+            for _ in range(40):
+                for question_type in question_types:
+                    question_1 = pool_1.next_question(question_type)
+                    question_2 = pool_2.next_question(question_type)
+                    self.assertEqual(question_1.short_question, question_2.short_question)
+        finally:
+            pool_1.close()
+            pool_2.close()
+
+    def test_unknown_question_type(self):
+        pool = questions.QuestionPool(["Mathematics"], seed=1)
+        self.assertIsNone(pool.next_question("Geography").short_question)
+        pool.close()
+
+
+class TestQuestion(unittest.TestCase):
+
+    def test_answer_worked_out_once(self):
+        question = questions.Question("Network and Broadcast Address of a Subnet", "192.168.1.77/24")
+        self.assertEqual(question.answer, "192.168.1.0 and 192.168.1.255")
+        self.assertTrue(question.is_correct("192.168.1.0 and 192.168.1.255"))
+        self.assertTrue(question.is_correct("  192.168.1.0  and 192.168.1.255\n"))
+        self.assertFalse(question.is_correct("192.168.1.0"))
+
+    def test_matches_evaluate_answer(self):
+        for question_type in questions.QUESTION_TYPES:
+            for _ in range(50):
+                question = questions.generate_question(question_type)
+                correct, _ = evaluate_answer(question_type, question.short_question, None)
+                self.assertEqual(question.answer, correct)
+
+
+class TestQuestionRegistry(unittest.TestCase):
+
+    def test_registered_plugin_type(self):
+        questions.register_question_type("Hexadecimal", lambda rng: format(rng.randint(0, 255), "X"),
+                                         lambda short_question: str(int(short_question, 16)))
+        try:
+            question = questions.generate_question("Hexadecimal")
+            self.assertEqual(question.answer, str(int(question.short_question, 16)))
+            self.assertEqual(questions.solve_answer("Hexadecimal", "FF"), "255")
+        finally:
+            del questions.QUESTION_TYPES["Hexadecimal"]
+
+    def test_client_and_server_agree(self):
+        from client import evaluate_answer as client_evaluate_answer
+        for short_question in ["10.0.0.1/33", "10.0.0.1/-1", "10.0.0.1/31", "10.0.0.1/8"]:
+            correct, _ = evaluate_answer("Usable IP Addresses of a Subnet", short_question, None)
+            self.assertEqual(correct, client_evaluate_answer("Usable IP Addresses of a Subnet", short_question))
+
+
+@unittest.skipIf(batch_solver is None, "numpy not installed")
+class TestBatchSolver(unittest.TestCase):
+    # property test, batch results must be identical to the scalar solvers for generated and malformed input
+    malformed = ["1.2.3.4/33", "1.2.3.4/-1", "300.2.3.4/8", "-1.2.3.4/8", "1.2.3/8", "1.2.3.4.5/8", "a/8", "1/2/3",
+                 None, " 1.2.3.4/ 8", "1.2.3.4/08", "99999999999.1.1.1/30", "1.2.3.4/", "1.2.3.4/+8", ""]
+
+    def test_subnet_batches_match_scalar(self):
+        rng = random.Random(1112)
+        short_questions = [questions.generate_usable_addresses_question(rng) for _ in range(5000)] + self.malformed
+        self.assertEqual(batch_solver.batch_usable_addresses(short_questions),
+                         [solvers.solve_usable_addresses(q) for q in short_questions])
+        self.assertEqual(batch_solver.batch_network_broadcast(short_questions),
+                         [solvers.solve_network_broadcast(q) for q in short_questions])
+
+    def test_roman_numeral_batches_match_scalar(self):
+        rng = random.Random(1112)
+        numerals = [questions.generate_roman_numerals_question(rng) for _ in range(5000)]
+        numerals += ["", "IIX", "IM", "MMMM", "abc", "XÎV", None]
+        self.assertEqual(batch_solver.batch_roman_numerals(numerals),
+                         [solvers.solve_roman_numerals(numeral) for numeral in numerals])
+
+
 # -- Helper functions for interacting with server.py --
 
+def wait_for_port(port, timeout=5.0):
+    # polls until a freshly started server accepts connections, a fixed sleep is either too short on a slow machine
+    # or wasted on a fast one
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.02)
+
+
 def receive_json_line(sock, timeout=2.0):
     # receives single json line from socket
     sock.settimeout(timeout)
@@ -270,6 +1184,28 @@ def send_json(sock, obj):
     sock.sendall(json.dumps(obj).encode('utf-8') + b"\n")
 
 
+def receive_message(sock, buffer, timeout=2.0):
+    # receives the next message in either wire format, whatever stays buffered is kept for the next call
+    sock.settimeout(timeout)
+    try:
+        while True:
+            message = next(buffer.messages(), None)
+            if message is not None:
+                return message
+            data = sock.recv(4096)
+            if not data:
+                return None
+            buffer.feed(data)
+    except socket.timeout:
+        return None
+
+
+def decode_payload(payload):
+    buffer = framing.MessageBuffer()
+    buffer.feed(payload)
+    return next(buffer.messages())
+
+
 if __name__ == '__main__':
     result = unittest.main(verbosity=2, exit=False)
     print("\n--- TEST SUMMARY ---")
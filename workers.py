@@ -0,0 +1,174 @@
+import json
+import os
+import socket
+import sys
+import zlib
+import event_log
+import handshake
+import rooms
+import server
+
+HANDOFF_SIZE = handshake.HANDSHAKE_SIZE  # the dispatcher never reads more than a handshake from a socket
+REPORT_SIZE = 64  # a worker's [auto matched joins, players in its filling auto room] report
+
+
+def main(config, engine, worker_count):
+    # Parent process accepts and reads HI, then hands each socket to the worker that owns the players room
+    listener = server.bind_listener(config["port"])
+
+    channels = []
+    for _ in range(worker_count):  # fork every worker before any thread is started
+        channels.append(start_worker(config, engine, listener, channels))
+    server.start_metrics(config)  # the dispatchers own metrics, worker i serves on "metrics_port" + i + 1
+
+    dispatcher = create_dispatcher(channels)
+
+    # Every handshake and report is read on this one thread, so the dispatcher needs no locks
+    def on_hello(connection, buffer, message, received):
+        dispatch_client(connection, message, received, dispatcher, config)
+
+    loop = handshake.HandshakeLoop(on_hello)
+    for index, channel in enumerate(channels):
+        loop.add_source(channel, lambda index=index: read_report(loop, dispatcher, index))
+    with listener:
+        loop.add_listener(listener)
+        try:
+            loop.run()
+        except KeyboardInterrupt:
+            pass
+
+
+def create_dispatcher(channels):
+    return {
+        "channels": channels,
+        # Per worker, auto matched players sent to it, and its last report of how many it joined and how many of
+        # those wait in its filling auto room. Used to send whole rooms to one worker
+        "auto": [{"sent": 0, "joined": 0, "filling": 0} for _ in channels],
+        "next_worker": 0  # where the next auto matched room goes
+    }
+
+
+def start_worker(config, engine, listener, channels):
+    # SEQPACKET keeps each handoff (bytes plus file descriptor) as one message
+    parent_channel, worker_channel = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    if os.fork() == 0:
+        listener.close()
+        parent_channel.close()
+        for channel in channels:  # other workers channels, otherwise they never see the parent exit
+            channel.close()
+        try:
+            server.start_metrics(config, len(channels) + 1)
+            server.start_event_log(config, f".worker{len(channels)}")
+            run_worker(worker_channel, config, engine)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            event_log.close_log()  # os._exit skips atexit, so queued events are written out here
+            sys.stdout.flush()
+            os._exit(0)
+
+    worker_channel.close()
+    return parent_channel
+
+
+def run_worker(channel, config, engine):
+    if engine == "asyncio":
+        import asyncio
+        import async_server
+        asyncio.run(async_server.serve_handoffs(channel, config))
+        return
+
+    lobby = WorkerLobby(config["players"], channel)
+    loop = server.create_handshake_loop(lobby, config)
+
+    def on_handoff():
+        handoff = receive_handoff(channel)
+        if handoff is None:  # dispatcher has gone away
+            loop.stop()
+            return
+        loop.add_connection(*handoff)
+
+    loop.add_source(channel, on_handoff)
+    loop.run()
+
+
+class WorkerLobby(rooms.Lobby):
+    # Tells the dispatcher whenever a player leaves the auto matched room filling up, it can't see leaves itself
+
+    def __init__(self, capacity, channel):
+        super().__init__(capacity)
+        self.channel = channel
+        self.auto_joined = 0
+
+    def join(self, player, room_id=None):
+        if room_id is None:
+            self.auto_joined += 1
+        return super().join(player, room_id)
+
+    def leave(self, player, room):
+        super().leave(player, room)
+        if room is not self.auto_room:
+            return
+        try:
+            self.channel.send(json.dumps([self.auto_joined, len(room.players)]).encode())
+        except OSError:
+            pass  # dispatcher has gone away
+
+
+def receive_handoff(channel):
+    # Returns the handed over socket and the bytes the dispatcher already read from it, None once the parent exits
+    try:
+        received, fds, _, _ = socket.recv_fds(channel, HANDOFF_SIZE, 1)
+    except OSError:
+        return None
+    if not fds:
+        return None
+    return socket.socket(fileno=fds[0]), received
+
+
+def dispatch_client(connection, message, received, dispatcher, config):
+    # received is forwarded as is, so the worker parses HI again exactly like a direct connection
+    index = pick_worker(dispatcher, server.read_room_id(message), config["players"])
+    try:
+        socket.send_fds(dispatcher["channels"][index], [received], [connection.fileno()])
+    except OSError:
+        pass
+    finally:
+        connection.close()  # the worker has its own copy of the socket
+
+
+def pick_worker(dispatcher, room_id, capacity):
+    # Room affinity, every player of a room must reach the same worker
+    worker_count = len(dispatcher["channels"])
+    if room_id is not None:
+        return zlib.crc32(room_id.encode()) % worker_count  # stable across processes unlike hash()
+
+    # Auto matched players go to a worker in groups of one room, so that worker's own lobby fills the room. A room
+    # left partly filled, e.g. after a player left it, is filled before a new one is started
+    filling = [auto_filling(auto, capacity) for auto in dispatcher["auto"]]
+    if any(filling):
+        index = max(range(worker_count), key=lambda i: filling[i])
+    else:
+        index = dispatcher["next_worker"]
+        dispatcher["next_worker"] = (index + 1) % worker_count
+    dispatcher["auto"][index]["sent"] += 1
+    return index
+
+
+def auto_filling(auto, capacity):
+    # Players in a worker's filling auto room, its last report plus the players sent since, a room starts once full
+    return (auto["filling"] + auto["sent"] - auto["joined"]) % capacity
+
+
+def read_report(loop, dispatcher, index):
+    channel = dispatcher["channels"][index]
+    try:
+        data = channel.recv(REPORT_SIZE)
+    except (BlockingIOError, InterruptedError):
+        return
+    except OSError:
+        data = b""
+    if not data:  # the worker exited
+        loop.forget(channel)
+        return
+    dispatcher["auto"][index]["joined"], dispatcher["auto"][index]["filling"] = json.loads(data)